@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+# Runs "ipaclmatch.py -p ... | optimacl.py ... | genacl.py ..." in one process
+# The records are passed between the stages as Python objects, not as text
+
+import argparse
+import shlex
+import sys
+
+import ipaclmatch
+import optimacl
+import genacl
+
+
+def debug(string, level=1):
+	if args.verbose >= level:
+		print(string, file=sys.stderr)
+
+
+# One match -> optimize -> generate chain
+# match, optimize, generate - lists of the ipaclmatch.py, optimacl.py and genacl.py options
+# optimize is None to skip the optimizer
+def run(match, optimize, generate):
+	ipaclmatch.setup(ipaclmatch.parser.parse_args(match))
+	if not ipaclmatch.args.policy:
+		print("ERROR: the ipaclmatch.py options must include -p (--policy)", file=sys.stderr)
+		sys.exit(1)
+	genacl.args = genacl.parser.parse_args(generate)
+	records = []
+	if optimize is None:
+		ipaclmatch.sink = records.append
+	else:
+		optimacl.args = optimacl.parser.parse_args(optimize)
+		policy = {}
+		star_nets = {}
+
+		# First iteration of the optimizer for every matching ACL line
+		def sink(record):
+			for srcnet, dstnet, service in optimacl.record_rules(record):
+				optimacl.add_rule(srcnet, dstnet, service, policy, star_nets)
+
+		ipaclmatch.sink = sink
+	for acl in ipaclmatch.args.acl:
+		debug("Reading from " + acl)
+		ipaclmatch.scan(ipaclmatch.read_acl(acl), acl)
+	if optimize is not None:
+		records = optimacl.policy_records(*optimacl.optimize(policy, star_nets))
+	policy = genacl.Policy(genacl.device(genacl.args), genacl.args.rn)
+	for record in records:
+		policy.addrule(genacl.PRule(record, genacl.args.deny))
+	policy.rprint()
+
+
+parser = argparse.ArgumentParser(description='Runs ipaclmatch.py -p, optimacl.py and genacl.py in one process',
+								 epilog='Example: aclpipe.py -m "-p --permit -a 10.1.2.0/24 -d fw.acl" -g "--dev fgt"')
+parser.add_argument('-m', '--match', action='append', required=True,
+					help='ipaclmatch.py options (quoted). Must include -p. Can be repeated to run several chains in a row')
+og = parser.add_mutually_exclusive_group()
+og.add_argument('-o', '--optimize', default='', help='optimacl.py options (quoted). A single option as --optimize=--nomerge')
+og.add_argument('--noopt', help='Do not optimize, same as "ipaclmatch.py -p ... | genacl.py ..."', action="store_true")
+parser.add_argument('-g', '--generate', default='', help='genacl.py options (quoted)')
+parser.add_argument('-v', '--verbose', default=0, help='Verbose mode. Messages are sent to STDERR', action='count')
+args = parser.parse_args()
+
+for match in args.match:
+	debug("ipaclmatch.py " + match)
+	run(shlex.split(match), None if args.noopt else shlex.split(args.optimize), shlex.split(args.generate))
@@ -5,9 +5,17 @@
 # http://www.cisco.com/c/en/us/td/docs/security/asa/asa90/configuration/guide/asa_90_cli_config/ref_ports.html
 
 import argparse
+import contextlib
+import heapq
+import io
+import multiprocessing
+import os
 import re
 import sys
 
+from asaports import s2n
+from zfile import zopen
+
 try:
 	import netaddr
 except ImportError:
@@ -50,50 +58,80 @@ def fillobj(obj, key, val):
 
 def unfold(objarr):
 	"""
-	Iterate through all objects in netgrp, srvgrp or prtgrp
+	Flatten all objects in netgrp, srvgrp or prtgrp
+	Every group is flattened once, after the groups it includes, and the result is reused by all parents.
+	Network groups are aggregated (unless --noaggr), so the parents merge the already aggregated children.
+	The number of their networks without aggregation is kept in netcnt for the element count.
+	The nesting is walked with a stack, not recursion, so deep nesting is fine.
+	Reference cycles and unknown names are reported and the references skipped.
 	"""
 	debug(objarr, 2)
-	for obj in objarr:
-		debug(obj, 3)
-		unfold_rec(objarr[obj], objarr)
-		if not args.noaggr and objarr is netgrp:
-			objarr[obj] = netaddr.cidr_merge(objarr[obj])
-
-
-def unfold_rec(obj, objarr, index=0):
-	"""
-	Unfold all included objects
-	objarr{} - netgrp, srvgrp, prtgrp
-	obj[] - curent object from objarr{} to unfold
-	index - curent index of objects in obj[]
-	"""
-	# We are starting with the index from the previous iteration
-	debug("unfold_rec", 4)
-	for i in range(index, len(obj)):
-		item = obj[i]
-		debug(item, 4)
-		# If object-group is found,
-		# recurse through the object-groups
-		if "object-group" in str(item):
-			# Add the content of the object-group
-			# item by item
-			for j in objarr[item.split()[1]]:
-				debug(j, 4)
-				obj.append(j)
-			# Remove the item with object-group
-			del obj[i]
-			# and dive into the new updated object
-			# We are passing the index we are currently on
-			unfold_rec(obj, objarr, i)
-		elif 'net-object' in str(item):
-			# if net-object is in the group
-			# get its address from netobj
-			obj.append(netobj[item.split()[1]])
-			del obj[i]
-			unfold_rec(obj, objarr, i)
-
-
-def html_hdr(title):
+	done = {}  # group name: True if flattened, False while its children are being flattened
+	for top in objarr:
+		if top in done:
+			continue
+		done[top] = False
+		# [group name, index of the next item to check]
+		stack = [[top, 0]]
+		while stack:
+			frame = stack[-1]
+			items = objarr[frame[0]]
+			while frame[1] < len(items):
+				item = items[frame[1]]
+				frame[1] += 1
+				if isinstance(item, str) and item.startswith('object-group '):
+					child = item.split()[1]
+					if child not in objarr:
+						debug(f"{frame[0]}: object-group {child} is not defined", 0)
+					elif child not in done:
+						# Flatten the child first
+						done[child] = False
+						stack.append([child, 0])
+						break
+					elif not done[child]:
+						path = [f[0] for f in stack]
+						debug("object-group cycle: " + " -> ".join(path[path.index(child):] + [child]), 0)
+			else:
+				debug(frame[0], 3)
+				objarr[frame[0]] = unfold_obj(frame[0], objarr, done)
+				done[frame[0]] = True
+				stack.pop()
+
+
+def unfold_obj(name, objarr, done):
+	"""
+	The content of one object with the included (already flattened) objects
+	name - the object in objarr{} with "object-group name" and "net-object name" references
+	"""
+	obj = []
+	cnt = 0  # networks of the included network groups, without aggregation
+	for item in objarr[name]:
+		if isinstance(item, str):
+			if item.startswith('object-group '):
+				child = item.split()[1]
+				# Undefined and cyclic references are skipped
+				if done.get(child):
+					obj.extend(objarr[child])
+					cnt += netcnt.get(child, 0)
+				continue
+			if item.startswith('net-object '):
+				objname = item.split()[1]
+				if objname in netobj:
+					obj.append(netobj[objname])
+					cnt += addr_count([netobj[objname]])
+				else:
+					debug(f"object network {objname} is not defined", 0)
+				continue
+		obj.append(item)
+		cnt += addr_count([item])
+	if objarr is netgrp:
+		netcnt[name] = cnt
+		if not args.noaggr:
+			obj = netaddr.cidr_merge(obj)
+	return obj
+
+
+def html_hdr(title, content='#content'):
 	print('<html lang=en><head><title>' + title + '</title></head><body> <style> \
 	body {background: #FFF5DD; color: #000080; font-family: sans-serif; padding-left: 20px; } \
 	table {color: #000080; font-size: 0.8em; border: solid 1px #000080; border-collapse: collapse; } \
@@ -102,35 +140,203 @@ def html_hdr(title):
 	a {color: #0000d0; text-decoration: none;} \
 	.permit {color: DarkGreen;} \
 	.deny {color: DarkRed;} </style> \
-	<h1>' + title + ' policy</h1><h4><a href=#content>Content</a></h4>')
+	<h1>' + title + ' policy</h1><h4><a href=' + content + '>Content</a></h4>', file=htmlout)
 
 
 def html_tbl_hdr(title):
 	print('<table border=1><caption id=' + title + '><h2>' + title + '</h2></caption> \
-	<tr><th>Line #</th><th>Source</th><th>Destination</th><th>Service</th><th>Action</th></tr>')
+	<tr><th>Line #</th><th>Source</th><th>Destination</th><th>Service</th><th>Action</th></tr>', file=htmlout)
 
 
 def html_tbl_ftr():
-	print('</table><br /><br />')
+	print('</table><br /><br />', file=htmlout)
 
 
-def html_ftr(content):
-	print('<div id=content><h2>Content</h2><ul>')
+def html_ftr(content, page=''):
+	print('<div id=content><h2>Content</h2><ul>', file=htmlout)
 	for i in content:
-		print('<li><a href=#' + i + '>' + i + '</a> ' + content[i] + '</i>')
-	print('</ul></div></body></html>')
+		print('<li><a href=' + (page_name(i) if page else '#' + i) + '>' + i + '</a> ' + content[i] + '</i>',
+			  file=htmlout)
+	if page:
+		print('<li><a href=' + page + '>Object-groups</a>', file=htmlout)
+	print('</ul></div></body></html>', file=htmlout)
+
+
+def page_name(acl):
+	"""
+	File name of the ACL page, with --pages
+	"""
+	return re.sub(r'[^\w.-]', '_', acl) + '.html'
+
+
+def page_open(acl):
+	"""
+	Close the table of the previous ACL and start a table of the ACL, with --pages
+	The tables are collected per ACL (the ACL lines may be not contiguous), pages_index() writes the pages
+	"""
+	global htmlout
+	page_close()
+	htmlout = aclpages.setdefault(acl, io.StringIO())
+	html_tbl_hdr(acl)
+
+
+def page_close():
+	global htmlout
+	if htmlout is not sys.stdout:
+		html_tbl_ftr()
+		htmlout = sys.stdout
+
+
+def pages_index():
+	"""
+	Write the ACL pages, the index page and the page with the object-groups used by the rules, with --pages
+	Every group is written once, the rules link to it
+	"""
+	global htmlout
+	page_close()
+	for acl, tables in aclpages.items():
+		with open(os.path.join(args.pages, page_name(acl)), 'w') as htmlout:
+			html_hdr(f'{hostname} {acl}', 'index.html')
+			htmlout.write(tables.getvalue())
+			print('</body></html>', file=htmlout)
+	with open(os.path.join(args.pages, 'objects.html'), 'w') as htmlout:
+		html_hdr(f'{hostname} object-groups', 'index.html')
+		for name in sorted(pagegrps):
+			members = netgrp.get(name) or srvgrp.get(name) or prtgrp.get(name) or []
+			print(f'<h3 id={name}>{name}</h3><p>' + '<br />'.join(map(str, members)) + '</p>', file=htmlout)
+		print('</body></html>', file=htmlout)
+	with open(os.path.join(args.pages, 'index.html'), 'w') as htmlout:
+		html_hdr(hostname)
+		html_ftr({acl: aclnames[acl] for acl in aclnames if acl in aclpages}, 'objects.html')
+	htmlout = sys.stdout
+
+
+def count_rule(rule, acl):
+	"""
+	Add the elements of the rule to the ACL counter and to the top rules
+	"""
+	src, dst, srv = rule.elements()
+	elements = src * dst * srv
+	cnt = aclcount.setdefault(acl, [0, 0])
+	cnt[0] += elements
+	if not Rule.remark:
+		cnt[1] += 1
+	if not elements:
+		return
+	global ruleseq
+	ruleseq += 1
+	# The earlier rule goes first if the elements are equal
+	item = (elements, -ruleseq, acl, rule.lnum, src, dst, srv, rule.origline.strip())
+	if not args.top:
+		toprules.append(item)
+	elif len(toprules) < args.top:
+		heapq.heappush(toprules, item)
+	elif item > toprules[0]:
+		heapq.heapreplace(toprules, item)
+
+
+def print_count():
+	"""
+	Print the elements per ACL and the top rules, with --count
+	ACL elements rules
+	elements src*dst*srv ACL line rule
+	"""
+	for acl, (elements, rules) in sorted(aclcount.items(), key=lambda x: -x[1][0]):
+		print(acl, elements, rules)
+	print("Total:", sum(cnt[0] for cnt in aclcount.values()), sum(cnt[1] for cnt in aclcount.values()))
+	print()
+	for elements, _, acl, lnum, src, dst, srv, line in sorted(toprules, reverse=True):
+		print(elements, f"{src}*{dst}*{srv}", acl, lnum, line)
+
+
+def addrs(nets):
+	"""
+	Networks of the rule, with the address ranges split into networks
+	"""
+	for net in nets:
+		if isinstance(net, netaddr.IPRange):
+			yield from net.cidrs()
+		else:
+			yield net
+
+
+def port2num(port):
+	"""
+	Port name or number to int, None if unknown
+	"""
+	port = s2n.get(port, port)
+	return int(port) if port.isdigit() else None
+
+
+def policy_srv(srv):
+	"""
+	Service from the rule or object-group to the ipaclmatch.py -p form: tcp:80, tcp:1000-2000, udp, icmp:8, * for ip
+	srv - proto or proto:ports, e.g. tcp:eq www, tcp,udp:range 1000 2000, tcp-udp:gt 1023, icmp:echo
+	Returns a list, as neq and tcp-udp give two services
+	"""
+	proto, ports = srv.split(":", 1) if ":" in srv else [srv, '']
+	protos = []
+	for p in proto.split(","):
+		protos += ['tcp', 'udp'] if p == 'tcp-udp' else [p]
+	arr = ports.split()
+	# Source ports are not supported
+	if 'destination' in arr:
+		arr = arr[arr.index('destination') + 1:]
+	elif arr and arr[0] == 'source':
+		arr = []
+	if not arr:
+		ranges = ['']
+	elif arr[0] in ('eq', 'range', 'gt', 'lt', 'neq'):
+		low = port2num(arr[1]) if len(arr) > 1 else None
+		high = port2num(arr[2]) if len(arr) > 2 else None
+		if low is None or arr[0] == 'range' and high is None:
+			debug(f"Unknown port in {srv}", 0)
+			return []
+		if arr[0] == 'eq':
+			ranges = [str(low)]
+		elif arr[0] == 'range':
+			ranges = [f'{low}-{high}']
+		# lt and gt do not include the port itself
+		elif arr[0] == 'gt':
+			ranges = [f'{low + 1}-65535']
+		elif arr[0] == 'lt':
+			ranges = [f'1-{low - 1}']
+		else:
+			ranges = [f'1-{low - 1}', f'{low + 1}-65535']
+	else:
+		# ICMP type
+		ranges = [s2n.get(arr[0], arr[0])]
+	return ['*' if p == 'ip' else p + ':' + r if r else p for p in protos for r in ranges]
+
+
+def addr_count(nets):
+	"""
+	Number of ACEs the device creates for the networks: an address range is expanded into networks
+	"""
+	return sum(1 for _ in addrs(nets))
+
+
+def srv_count(srv):
+	"""
+	Number of ACEs the device creates for the service: one per protocol, tcp-udp counts as two
+	"""
+	proto = srv.split(":", 1)[0]
+	return sum(2 if p == 'tcp-udp' else 1 for p in proto.split(","))
 
 
 class Rule:
 	"""Class for an ACL rule"""
 	# access-list myacl remark My best rule
 	re_acl_rem = re.compile(r'^\s*access-list\s+\S+\s+remark\s+(?P<acl_rem>.*$)', re.IGNORECASE)
+	re_log = re.compile(r'\s+log$|\s+log\s+.*$')
+	re_any = re.compile(r'\bany\b|\bany4\b')
 	
 	# All subsequent remarks are concatenated in this persistent variable
 	remark = ''
 	
 	def __init__(self, lnum, line):
 		self.lnum = lnum
+		self.origline = line
 		self.line = line
 		self.name = ''
 		self.src = []
@@ -139,6 +345,7 @@ class Rule:
 		self.proto = []
 		self.action = ''
 		self.rem = ''
+		self.grp = {}  # field (src, dst, proto or srv) -> object-group name
 		self.isinactive = False
 		self.cleanup()
 		self.parse()
@@ -147,19 +354,20 @@ class Rule:
 		"""
 		Simple clean-up
 		"""
-		self.line = re.sub(r'\s+log$|\s+log\s+.*$', '', self.line)
-		self.line = re.sub(r'\bany\b|\bany4\b', '0.0.0.0 0.0.0.0', self.line)
+		self.line = Rule.re_log.sub('', self.line)
+		self.line = Rule.re_any.sub('0.0.0.0 0.0.0.0', self.line)
 	
 	def parse(self):
 		"""
 		access-list line parser
 		"""
-		if Rule.re_acl_rem.search(self.line):
+		m = Rule.re_acl_rem.search(self.origline)
+		if m:
 			# Found Remarked ACL
 			# Was the prev rule also remarked? If yes, add <br>
 			if Rule.remark:
 				Rule.remark += '<br />'
-			Rule.remark += Rule.re_acl_rem.search(line).group('acl_rem')
+			Rule.remark += m.group('acl_rem')
 			debug(f"Rule.remark = {Rule.remark}", 3)
 		else:
 			# Clean the remarks
@@ -179,8 +387,10 @@ class Rule:
 			if 'object-group' in arr[0]:
 				if arr[1] in prtgrp:
 					self.proto = prtgrp[arr[1]]
+					self.grp['proto'] = arr[1]
 				else:
 					self.srv = srvgrp[arr[1]]
+					self.grp['srv'] = arr[1]
 				debug(f"srv = service object group {arr[1]} {self.srv}", 4)
 				del arr[0:2]
 			elif 'object' in arr[0]:
@@ -196,6 +406,7 @@ class Rule:
 			
 			if 'object-group' in arr[0]:
 				self.src = netgrp[arr[1]]
+				self.grp['src'] = arr[1]
 			elif 'object' in arr[0]:
 				self.src = [netobj[arr[1]]]
 			elif 'host' in arr[0]:
@@ -214,6 +425,7 @@ class Rule:
 			
 			if 'object-group' in arr[0]:
 				self.dst = netgrp[arr[1]]
+				self.grp['dst'] = arr[1]
 			elif 'object' in arr[0]:
 				self.dst = [netobj[arr[1]]]
 			elif 'host' in arr[0]:
@@ -227,6 +439,7 @@ class Rule:
 			if len(arr) > 0:
 				if 'object-group' in arr[0]:
 					self.srv = srvgrp[arr[1]]
+					self.grp['srv'] = arr[1]
 				else:
 					self.srv = [','.join(self.proto) + ':' + ' '.join(arr[:])]
 			elif not self.srv:
@@ -247,6 +460,36 @@ class Rule:
 								   ports]))
 			self.rem = ''
 	
+	def policy(self):
+		"""
+		Generate the rule lines in the ipaclmatch.py -p form:
+		SrcIP SrcMask DstIP DstMask Service [deny]
+		The lines are generated one by one, the object-groups are not expanded in memory
+		"""
+		if Rule.remark or args.permit and self.action != 'permit' or args.deny and self.action != 'deny':
+			return
+		action = ' deny' if self.action == 'deny' and not args.deny else ''
+		services = [svc for srv in self.srv for svc in policy_srv(srv)]
+		dsts = [' '.join([str(dst.ip), str(dst.netmask)]) for dst in addrs(self.dst)]
+		for src in addrs(self.src):
+			src = ' '.join([str(src.ip), str(src.netmask)])
+			for dst in dsts:
+				for svc in services:
+					yield ' '.join([src, dst, svc]) + action
+
+	def elements(self):
+		"""
+		Number of the source, destination and service elements of the rule, (0, 0, 0) for remarks
+		The device expands the object-groups without aggregation, so the rule takes
+		src * dst * srv ACEs. Nothing is expanded here, the counts are multiplied.
+		The network groups are counted by netcnt, as they may be aggregated for the output
+		"""
+		if Rule.remark:
+			return 0, 0, 0
+		src = netcnt[self.grp['src']] if 'src' in self.grp else addr_count(self.src)
+		dst = netcnt[self.grp['dst']] if 'dst' in self.grp else addr_count(self.dst)
+		return src, dst, sum(srv_count(srv) for srv in self.srv)
+
 	def html(self):
 		"""
 		Print the rule as an HTML table row
@@ -254,9 +497,10 @@ class Rule:
 		if not Rule.remark:
 			# Are there accumulated comments?
 			if self.rem:
-				print('<tr><td colspan=5>' + self.rem + '</td></tr>')
-			print(f'<tr>{self.html_lnum()} {self.html_obj(self.src)} {self.html_obj(self.dst)}'
-				  f'{self.html_obj(self.proto)} {self.html_obj(self.srv)} {self.html_action(self.action)}</tr>')
+				print('<tr><td colspan=5>' + self.rem + '</td></tr>', file=htmlout)
+			print(f'<tr>{self.html_lnum()} {self.html_obj(self.src, "src")} {self.html_obj(self.dst, "dst")}'
+				  f'{self.html_obj(self.proto, "proto")} {self.html_obj(self.srv, "srv")} '
+				  f'{self.html_action(self.action)}</tr>', file=htmlout)
 	
 	def html_action(self, act):
 		"""
@@ -267,12 +511,17 @@ class Rule:
 		else:
 			return '<td><span class=deny>' + act + '</span></td>'
 	
-	def html_obj(self, obj):
+	def html_obj(self, obj, field):
 		"""
 		Print out the content of the object-group with <br /> in between
+		With --pages, a link to the object-group and the number of its members
 		"""
 		debug(f"html_obj {obj}", 4)
 		#debug(obj, 4)
+		if args.pages and field in self.grp:
+			name = self.grp[field]
+			pagegrps.add(name)
+			return f'<td><a href=objects.html#{name}>{name}</a> ({len(obj)})</td>'
 		return '<td>' + '<br />'.join(map(lambda x: str(x), obj)) + '</td>'
 	
 	def html_lnum(self):
@@ -287,24 +536,71 @@ parser.add_argument("-v", "--verbose", default=0,
 					action="count")
 out = parser.add_mutually_exclusive_group()
 out.add_argument('--html', default=True, help="Cisco policy to HTML", action="store_true")
+parser.add_argument('--pages', metavar='DIR',
+					help="With --html, write one page per ACL, the index and the object-groups pages to DIR. "
+						 "The rules link to the object-groups instead of listing their content")
 out.add_argument('--acl', default=False, help="Cisco policy to sh access-list", action="store_true")
+out.add_argument('--policy', default=False,
+				 help="Cisco policy to the proto-policy (same as ipaclmatch.py -p): SrcIP SrcMask DstIP DstMask Service [deny]",
+				 action="store_true")
+out.add_argument('--count', default=False,
+				 help="Estimate the number of ACEs (elements) per ACL and list the rules with the most elements",
+				 action="store_true")
+parser.add_argument('--top', default=10, type=int,
+					help="With --count, the number of the rules to list (default 10), 0 - all rules")
 parser.add_argument('--noaggr', default=False, help="Do not aggregate networks", action="store_true")
-args = parser.parse_args()
-if args.acl:
-	args.html = False
-
-netobj = {}  # network-objects
-netgrp = {}  # network-groups
-srvgrp = {}  # service-groups
-prtgrp = {}  # protocol-groups
-aclmode = False
-rulecnt = 0  # ACL rule counter
-curacl = ''  # current ACL name
-aclnames = {}  # ACL names and interfaces
-# global curobj points to the current dict: netobj, netgrp or srvgrp
-# global curname points to the current object name
-# curproto points to the current protocol
-# global curobj,curname
+parser.add_argument('--name', help="Only the ACL with this name")
+dp = parser.add_mutually_exclusive_group()
+dp.add_argument('--deny', help="With --policy, only the deny rules", action="store_true")
+dp.add_argument('--permit', help="With --policy, only the permit rules", action="store_true")
+parser.add_argument('--fleet', metavar='LIST',
+					help="Convert fwname/fwname.conf of every firewall in LIST (asa.list) in parallel to fwname/fwname.html "
+						 "(.acl, .policy, .count) and print the summary of all firewalls")
+parser.add_argument('-j', '--jobs', type=int,
+					help="With --fleet, the number of the firewalls converted in parallel (default: the number of CPUs)")
+args = parser.parse_args([])
+
+
+# Called once before converting: by the main program and in every --fleet worker
+def setup(options):
+	global args
+	args = options
+	if args.acl or args.policy or args.count:
+		args.html = False
+	if args.pages and not args.html:
+		parser.error("--pages requires --html")
+
+
+def reset():
+	"""
+	Forget the objects and ACLs of the previous configuration
+	"""
+	global netobj, netgrp, netcnt, srvgrp, prtgrp, aclmode, rulecnt, curacl, aclnames, hostname, htmlout
+	global pagegrps, aclpages, aclcount, toprules, ruleseq
+	netobj = {}  # network-objects
+	netgrp = {}  # network-groups
+	netcnt = {}  # network-group name -> number of its networks without aggregation
+	srvgrp = {}  # service-groups
+	prtgrp = {}  # protocol-groups
+	aclmode = False
+	rulecnt = 0  # ACL rule counter
+	curacl = ''  # current ACL name
+	aclnames = {}  # ACL names and interfaces
+	hostname = ''
+	htmlout = sys.stdout  # current HTML output, the ACL page with --pages
+	pagegrps = set()  # object-groups used by the rules, with --pages
+	aclpages = {}  # ACL name -> its HTML tables, with --pages
+	aclcount = {}  # ACL name -> [elements, rules], with --count and --fleet
+	toprules = []  # heap of (elements, -seq, ACL name, line number, src, dst, srv, rule), with --count and --fleet
+	ruleseq = 0  # rule sequence number for toprules
+	Rule.remark = ''
+	# global curobj points to the current dict: netobj, netgrp or srvgrp
+	# global curname points to the current object name
+	# curproto points to the current protocol
+	# global curobj,curname
+
+
+reset()
 
 # hostname fw_name
 re_hostname = re.compile(r'^\s*hostname\s+(?P<hostname>\S+)', re.IGNORECASE)
@@ -371,92 +667,261 @@ re_aclname = re.compile(r'^\s*access-list\s+(?P<acl_name>\S+)\s+', re.IGNORECASE
 # access-group management_acl in interface management
 re_aclgrp = re.compile(r'^\s*access-group\s+(?P<acl_name>\S+)\s+(?P<acl_int>.*$)', re.IGNORECASE)
 
-f = sys.stdin if "-" == args.conf else open(args.conf, "r")
-
-for line in f:
-	line = line.strip()
-	debug(line, 3)
-	# Parsing and filling in the network and service objects
-	if re_isinactive.match(line) or re_descr.match(line):
-		debug(f"{line} -- ignored")
-		continue
-	if not aclmode:
-		if args.html and re_hostname.search(line):
-			html_hdr(re_hostname.search(line).group('hostname'))
-		elif re_objnet.search(line):
-			newobj(netobj, re_objnet.search(line).group('obj_name'))
-		elif re_subnet.search(line):
-			curobj[curname] = netaddr.IPNetwork(re_subnet.search(line).group('ip') +
-												'/' + re_subnet.search(line).group('mask'))
-		elif re_range.search(line):
-			curobj[curname] = netaddr.IPRange(re_range.search(line).group('ip1'), re_range.search(line).group('ip2'))
-		elif re_host.search(line):
-			curobj[curname] = netaddr.IPNetwork(re_host.search(line).group('ip') + '/32')
-		elif re_netgrp.search(line):
-			newobj(netgrp, re_netgrp.search(line).group('net_grp'))
-		elif re_netobj_host.search(line):
-			fillobj(curobj, curname, netaddr.IPNetwork(re_netobj_host.search(line).group('ip') + '/32'))
-		elif re_netobj_obj.search(line):
-			fillobj(curobj, curname, 'net-object ' + re_netobj_obj.search(line).group('obj_name'))
-		elif re_netobj.search(line):
-			fillobj(curobj, curname, netaddr.IPNetwork(re_netobj.search(line).group('ip') +
-													   '/' + re_netobj.search(line).group('mask')))
-		elif re_protogrp.search(line):
-			newobj(prtgrp, re_protogrp.search(line).group('prt_grp'))
-		elif re_protobj.search(line):
-			fillobj(curobj, curname, re_protobj.search(line).group('prt_obj'))
-		elif re_srvgrp.search(line):
-			newobj(srvgrp, re_srvgrp.search(line).group('srv_grp'))
-		elif re_objsrv.search(line):
-			newobj(srvgrp, re_objsrv.search(line).group('srv_obj'))
-		elif re_grpobj.search(line):
-			fillobj(curobj, curname, 'object-group ' + re_grpobj.search(line).group('grp_obj'))
-		elif re_srvobj_obj.search(line):
-			fillobj(curobj, curname, re_srvobj_obj.search(line).group('srv_obj'))
-		elif re_srvobj.search(line):
-			fillobj(curobj, curname, re_srvobj.search(line).group('proto') + ':' +
-					re_srvobj.search(line).group('service'))
-		elif re_srvobj_1.search(line):
-			fillobj(curobj, curname, re_srvobj_1.search(line).group('proto') + ':' +
-					re_srvobj_1.search(line).group('service'))
-		elif re_srvgrp_proto.search(line):
-			newobj(srvgrp, re_srvgrp_proto.search(line).group('srv_grp'))
-			curproto = re_srvgrp_proto.search(line).group('proto')
-		elif re_portobj.search(line):
-			fillobj(curobj, curname, curproto + ':' + re_portobj.search(line).group('service'))
-		elif re_srvobj_ip.search(line):
-			fillobj(curobj, curname, re_srvobj_ip.search(line).group('proto'))
-		elif re_isacl.search(line):
-			aclmode = True
-			debug("netgrp", 2)
-			unfold(netgrp)
-			debug("srvgrp", 2)
-			unfold(srvgrp)
-			debug("prtgrp", 2)
-			unfold(prtgrp)
+# Handlers of the matching config lines
+# m - the match object of the line regex
+
+def on_hostname(m):
+	global hostname
+	hostname = m.group('hostname')
+	if args.html and not args.pages:
+		html_hdr(m.group('hostname'))
+
+
+def on_objnet(m):
+	newobj(netobj, m.group('obj_name'))
+
+
+def on_subnet(m):
+	curobj[curname] = netaddr.IPNetwork(m.group('ip') + '/' + m.group('mask'))
+
+
+def on_range(m):
+	curobj[curname] = netaddr.IPRange(m.group('ip1'), m.group('ip2'))
+
+
+def on_host(m):
+	curobj[curname] = netaddr.IPNetwork(m.group('ip') + '/32')
+
+
+def on_netgrp(m):
+	newobj(netgrp, m.group('net_grp'))
+
+
+def on_netobj_host(m):
+	fillobj(curobj, curname, netaddr.IPNetwork(m.group('ip') + '/32'))
+
+
+def on_netobj_obj(m):
+	fillobj(curobj, curname, 'net-object ' + m.group('obj_name'))
+
+
+def on_netobj(m):
+	fillobj(curobj, curname, netaddr.IPNetwork(m.group('ip') + '/' + m.group('mask')))
+
+
+def on_protogrp(m):
+	newobj(prtgrp, m.group('prt_grp'))
+
+
+def on_protobj(m):
+	fillobj(curobj, curname, m.group('prt_obj'))
+
+
+def on_srvgrp(m):
+	newobj(srvgrp, m.group('srv_grp'))
+
+
+def on_objsrv(m):
+	newobj(srvgrp, m.group('srv_obj'))
+
+
+def on_grpobj(m):
+	fillobj(curobj, curname, 'object-group ' + m.group('grp_obj'))
+
+
+def on_srvobj_obj(m):
+	# Service objects are kept in srvgrp as well
+	fillobj(curobj, curname, 'object-group ' + m.group('srv_obj'))
+
+
+def on_srvobj(m):
+	fillobj(curobj, curname, m.group('proto') + ':' + m.group('service'))
+
+
+def on_srvgrp_proto(m):
+	global curproto
+	newobj(srvgrp, m.group('srv_grp'))
+	curproto = m.group('proto')
+
+
+def on_portobj(m):
+	fillobj(curobj, curname, curproto + ':' + m.group('service'))
+
+
+def on_srvobj_ip(m):
+	fillobj(curobj, curname, m.group('proto'))
+
+
+def on_isacl(m):
+	global aclmode
+	aclmode = True
+	debug("netgrp", 2)
+	unfold(netgrp)
+	debug("srvgrp", 2)
+	unfold(srvgrp)
+	debug("prtgrp", 2)
+	unfold(prtgrp)
+
+
+# The first word of the line (lowercase) -> [(regex, handler), ...]
+# The regexes are tried in this order, every regex at most once per line
+# Lines with other first words are skipped without any regex
+objparsers = {
+	'hostname': [(re_hostname, on_hostname)],
+	'object': [(re_objnet, on_objnet), (re_objsrv, on_objsrv)],
+	'subnet': [(re_subnet, on_subnet)],
+	'range': [(re_range, on_range)],
+	'host': [(re_host, on_host)],
+	'object-group': [(re_netgrp, on_netgrp), (re_protogrp, on_protogrp), (re_srvgrp, on_srvgrp),
+					 (re_srvgrp_proto, on_srvgrp_proto)],
+	'network-object': [(re_netobj_host, on_netobj_host), (re_netobj_obj, on_netobj_obj), (re_netobj, on_netobj)],
+	'protocol-object': [(re_protobj, on_protobj)],
+	'group-object': [(re_grpobj, on_grpobj)],
+	'service-object': [(re_srvobj_obj, on_srvobj_obj), (re_srvobj, on_srvobj), (re_srvobj_ip, on_srvobj_ip)],
+	'service': [(re_srvobj_1, on_srvobj)],
+	'port-object': [(re_portobj, on_portobj)],
+	'access-list': [(re_isacl, on_isacl)],
+}
+
+def convert(f):
+	"""
+	Read the configuration from f and print it in the selected form
+	"""
+	global curacl, rulecnt
+	reset()
+	if args.pages:
+		os.makedirs(args.pages, exist_ok=True)
+	for line in f:
+		line = line.strip()
+		debug(line, 3)
+		if not line: continue
+		keyword = line.split(None, 1)[0].lower()
+		# Parsing and filling in the network and service objects
+		if keyword == 'description' or keyword == 'access-list' and re_isinactive.match(line):
+			debug(f"{line} -- ignored")
+			continue
+		if not aclmode:
+			for regex, handler in objparsers.get(keyword, ()):
+				m = regex.search(line)
+				if m:
+					handler(m)
+					break
 	
-	# Parsing access-lists
-	if aclmode:
-		if re_aclname.search(line):
-			newacl = re_aclname.search(line).group('acl_name')
-			if not curacl == newacl:
-				curacl = newacl
-				aclnames[curacl] = ''
-				if args.html:
-					if rulecnt:
-						html_tbl_ftr()
-					html_tbl_hdr(curacl)
-				rulecnt = 1
-			r = Rule(rulecnt, line)
+		# Parsing access-lists
+		if aclmode:
+			if keyword == 'access-list':
+				m = re_aclname.search(line)
+			elif keyword == 'access-group':
+				m = re_aclgrp.search(line)
+			else:
+				continue
+			if not m:
+				continue
+			if keyword == 'access-list':
+				newacl = m.group('acl_name')
+				if not curacl == newacl:
+					curacl = newacl
+					aclnames[curacl] = ''
+					if args.pages:
+						# No pages for the ACLs filtered out by --name
+						if not args.name or curacl == args.name:
+							page_open(curacl)
+						else:
+							page_close()
+					elif args.html:
+						if rulecnt:
+							html_tbl_ftr()
+						html_tbl_hdr(curacl)
+					rulecnt = 1
+				if not args.name or curacl == args.name:
+					r = Rule(rulecnt, line)
+					if args.html:
+						r.html()
+					elif args.policy:
+						for rule in r.policy():
+							print(rule)
+					elif not args.count:
+						r.rprint()
+					if args.count or args.fleet:
+						count_rule(r, curacl)
+				rulecnt += 1
+			# Assign interfaces and directions to the corresponding access-groups
+			else:
+				aclnames[m.group('acl_name')] = m.group('acl_int')
+
+	if args.pages:
+		pages_index()
+	elif args.html:
+		html_tbl_ftr()
+		html_ftr(aclnames)
+	elif args.count:
+		print_count()
+
+
+def fleet_device(fw):
+	"""
+	Convert fw/fw.conf in a worker process of the --fleet pool
+	The output goes to fw/fw.html (.acl, .policy, .count), the --pages to fw/DIR/
+	Returns the summary of the firewall: name, hostname, ACLs, rules, elements, network objects,
+	network, service and protocol groups; or the name and the error message
+	"""
+	global args
+	options = args
+	args = argparse.Namespace(**vars(options))
+	ext = 'acl' if args.acl else 'policy' if args.policy else 'count' if args.count else 'html'
+	if args.pages:
+		args.pages = os.path.join(fw, args.pages)
+	try:
+		with io.TextIOWrapper(zopen(os.path.join(fw, fw + '.conf'))) as f, \
+				open(os.devnull if args.pages else os.path.join(fw, fw + '.' + ext), 'w') as out, \
+				contextlib.redirect_stdout(out):
+			convert(f)
+	except Exception as e:
+		return fw, f"{type(e).__name__}: {e}"
+	finally:
+		args = options
+	return (fw, hostname, len(aclcount), sum(cnt[1] for cnt in aclcount.values()),
+			sum(cnt[0] for cnt in aclcount.values()), len(netobj), len(netgrp), len(srvgrp), len(prtgrp))
+
+
+def fleet():
+	"""
+	Convert the configurations of all firewalls in the --fleet list and print the summary
+	The list has the same format as asa.list: IP-address fwname
+	"""
+	with open(args.fleet) as f:
+		fws = [line.split()[-1] for line in f if line.strip() and not line.startswith('#')]
+	total = [0] * 7
+	converted = 0
+	if args.html:
+		html_hdr('Fleet', '#')
+		print('<table border=1><tr><th>Firewall</th><th>Hostname</th><th>ACLs</th><th>Rules</th><th>Elements</th>'
+			  '<th>Objects</th><th>Network groups</th><th>Service groups</th><th>Protocol groups</th></tr>')
+	else:
+		print("# firewall hostname ACLs rules elements objects network-groups service-groups protocol-groups")
+	with multiprocessing.Pool(args.jobs, setup, (args,)) as pool:
+		for summary in pool.imap(fleet_device, fws):
+			if len(summary) == 2:
+				debug("%s: %s" % summary, 0)
+				continue
+			converted += 1
+			total = [a + b for a, b in zip(total, summary[2:])]
 			if args.html:
-				r.html()
+				fw = summary[0]
+				link = os.path.join(fw, args.pages, 'index.html') if args.pages else os.path.join(fw, fw + '.html')
+				print(f'<tr><td><a href={link}>{fw}</a></td>' + ''.join(f'<td>{i}</td>' for i in summary[1:]) + '</tr>')
 			else:
-				r.rprint()
-			rulecnt += 1
-		# Assign interfaces and directions to the corresponding access-groups
-		elif re_aclgrp.search(line):
-			aclnames[re_aclgrp.search(line).group('acl_name')] = re_aclgrp.search(line).group('acl_int')
-
-if args.html:
-	html_tbl_ftr()
-	html_ftr(aclnames)
+				print(*summary)
+	if args.html:
+		print(f'<tr><td>Total</td><td>{converted}</td>' + ''.join(f'<td>{i}</td>' for i in total) + '</tr></table></body></html>')
+	else:
+		print("Total:", converted, *total)
+
+
+if __name__ == '__main__':
+	setup(parser.parse_args())
+	if args.fleet:
+		fleet()
+	else:
+		# Compressed configurations are decompressed on the fly
+		convert(io.TextIOWrapper(zopen(args.conf)))
@@ -4,12 +4,6 @@
 # Takes a list of IP's as an argument
 # E.g. asasearch.sh 10.0.1.64/28,10.0.1.68
 IPS=$*
-for acl in */*.acl
-do
-	for dir in src dst
-	do
-		eval cnt${dir}=`ipaclmatch.py --noany --permit --$dir -a $IPS $acl | wc -l | awk '{print $1}'`
-#		eval cnt${dir}=`ipaclmatch.py --permit --$dir -a $IPS $acl | wc -l | awk '{print $1}'`
-	done
-	echo $acl $cntsrc $cntdst
-done
+JOBS=`getconf _NPROCESSORS_ONLN`
+ipaclmatch.py --jobs $JOBS --count --noany --permit -a $IPS */*.acl
+#ipaclmatch.py --jobs $JOBS --count --permit -a $IPS */*.acl
@@ -4,6 +4,8 @@ import string
 import argparse
 import re
 import sys
+import json
+import socket
 
 try:
 	import netaddr
@@ -38,6 +40,7 @@ class PRule:
 	def __init__(self, line, deny=False):
 		"""
 		line (str) - policy line
+		line (dict) - policy record (see parse_record), e.g. from optimacl.policy_records()
 		deny (boolean) - by default the action is "allow", unless there is an explicit "deny" in the line
 		if deny is set to True, the action will be "deny"
 		"""
@@ -48,6 +51,11 @@ class PRule:
 		self.num = 0  # rule number
 		self.action = "deny" if deny else "permit"
 		self.comment = ""
+		if isinstance(line, dict):
+			self.type = "rule"
+			self.origline = self.line = line
+			self.parse_record(line)
+			return
 		line = line.strip()
 		self.origline = line
 		# If the line begins with "#" it's a comment
@@ -58,6 +66,15 @@ class PRule:
 			return
 		else:
 			self.type = "rule"
+		# JSON record (ipaclmatch.py --json or optimacl.py --json)
+		if line.startswith("{"):
+			self.line = line
+			try:
+				record = json.loads(line)
+			except ValueError:
+				record = None
+			self.parse_record(record)
+			return
 		self.line = self.cleanup(line)
 		debug(self.line, 2)
 		self.parse()
@@ -81,6 +98,15 @@ class PRule:
 		tmp = netaddr.IPNetwork(addr)
 		return ' '.join([str(tmp.ip), str(tmp.netmask)])
 	
+	def int2str(self, net):
+		"""
+		net = [addr, prefixlen] with an integer addr
+		return = 1.2.3.4 255.255.255.255
+		"""
+		addr, plen = net
+		mask = (0xffffffff << (32 - plen)) & 0xffffffff
+		return ' '.join([socket.inet_ntoa(addr.to_bytes(4, 'big')), socket.inet_ntoa(mask.to_bytes(4, 'big'))])
+
 	def check_arr(self, arr):
 		if not len(arr):
 			debug(self.line, 0)
@@ -131,6 +157,33 @@ class PRule:
 		else:
 			return [addr + ' 255.255.255.255']
 
+	def parse_record(self, record):
+		"""
+		record: {"src": [[addr, prefixlen], ...], "dst": [...], "srv": [...], "action": "deny", "comment": "..."}
+		The addresses are integers, so no netaddr parsing is needed
+		"""
+		try:
+			self.src = self.parse_nets(record['src'])
+			self.dst = self.parse_nets(record['dst'])
+			self.srv = sorted(record['srv'])
+		except (ValueError, KeyError, TypeError):
+			debug(self.line, 0)
+			debug("Not a valid policy record. Expected: {\"src\": [[addr, prefixlen]], \"dst\": [[addr, prefixlen]], \"srv\": [service]}", 0)
+			sys.exit(1)
+		self.action = record.get('action', self.action)
+		self.comment = record.get('comment', '')
+		debug("Src = %s" % self.src, 3)
+		debug("Dst = %s" % self.dst, 3)
+		debug("Srv = %s" % self.srv, 3)
+		debug("Action = %s" % self.action, 3)
+
+	def parse_nets(self, nets):
+		"""
+		nets -- a list of [addr, prefixlen] from a JSON record
+		returns a list of addresses, same as parse_addr for the same networks in the CIDR form (optimacl.py output)
+		"""
+		return sorted(self.int2str(net) for net in nets)
+
 	def parse(self):
 		addr1 = ''
 		addr2 = ''
@@ -440,9 +493,9 @@ class ASA(FW):
 				if rule.comment:
 					print(' '.join(["access-list", self.aclname, "line %s" % rule.num, "remark", rule.comment]))
 				print(' '.join(["access-list", self.aclname, "line %s" % rule.num, "extended", self.action[rule.action],
-								 self.rule_proto(rule), self.rule_addr(rule.src), self.rule_addr(rule.dst), self.rule_port(rule), self.log]))
+								 self.rule_proto(rule, policy), self.rule_addr(rule.src, policy), self.rule_addr(rule.dst, policy), self.rule_port(rule), self.log]))
 
-	def rule_proto(self, rule):
+	def rule_proto(self, rule, policy):
 		if len(rule.srv) > 1:
 			return 'object-group ' + policy.srvgrp[tuple(rule.srv)]
 		else:
@@ -454,7 +507,7 @@ class ASA(FW):
 		else:
 			return self.port(rule.srv[0])
 
-	def rule_addr(self, addr):
+	def rule_addr(self, addr, policy):
 		if len(addr) > 1:
 			return 'object-group ' + policy.netgrp[tuple(addr)]
 		else:
@@ -612,18 +665,15 @@ class Policy():
 	Class for the whole policy
 	"""
 	
-	netobj = {}		# { '10.0.1.0 255.255.255.0': 'n-010.000.001.000_24' }
-	srvobj = {}		# { 'tcp:20-23': 'TCP-20-23' }
-	netgrp = {}		# { 'net-group1: }network-groups
-	srvgrp = {}		# service-groups
-	policy = []		# global policy
-	device = ''		# 'ASA' or 'FGT' class object
-
-
 # dev - device class
 # rulenum - the number of the first rule
 	def __init__(self, dev, rulenum):
-		self.device = dev
+		self.netobj = {}		# { '10.0.1.0 255.255.255.0': 'n-010.000.001.000_24' }
+		self.srvobj = {}		# { 'tcp:20-23': 'TCP-20-23' }
+		self.netgrp = {}		# { 'net-group1: }network-groups
+		self.srvgrp = {}		# service-groups
+		self.policy = []		# global policy
+		self.device = dev		# 'ASA' or 'FGT' class object
 		self.rulenum = rulenum	#current rule number counter
 
 	def addrule(self, rule):
@@ -690,28 +740,35 @@ r77.add_argument('--policy', default='test', help="CheckPoint policy name. 	Defa
 parser.add_argument('--nodbedit', default=False, help="Do not add dbedit decorations", action="store_true")
 
 
-args = parser.parse_args()
+# The device class object for the options
+def device(args):
+	if 'asa' in args.dev:
+		return ASA(args.acl, args.log, args.comment)
+	elif 'fgt' in args.dev:
+		if args.nolog: args.log = "disable"
+		return FGT(args.vdom, args.si, args.di, args.label, args.log, args.comment)
+	elif 'r77' in args.dev:
+		if args.nolog: args.log = "disable"
+		return R77(args.policy, args.log, args.comment, args.nodbedit)
+	else:
+		print(args.dev, "is not supported. It should be: asa (Cisco ASA), fgt (FortiGate) or r77 (CheckPOint R77)", file=sys.stderr)
+		sys.exit(1)
 
-debug("Verbosity level is %d" % args.verbose, 1)
 
-f = sys.stdin if "-" == args.pol else open(args.pol, "r")
+# The defaults, when imported (see aclpipe.py)
+args = parser.parse_args([])
 
-if 'asa' in args.dev:
-	dev = ASA(args.acl, args.log, args.comment)
-elif 'fgt' in args.dev:
-	if args.nolog: args.log = "disable"
-	dev = FGT(args.vdom, args.si, args.di, args.label, args.log, args.comment)
-elif 'r77' in args.dev:
-	if args.nolog: args.log = "disable"
-	dev = R77(args.policy, args.log, args.comment, args.nodbedit)
-else:
-	print(args.dev, "is not supported. It should be: asa (Cisco ASA), fgt (FortiGate) or r77 (CheckPOint R77)", file=sys.stderr)
-	sys.exit(1)
+if __name__ == '__main__':
+	args = parser.parse_args()
+
+	debug("Verbosity level is %d" % args.verbose, 1)
+
+	f = sys.stdin if "-" == args.pol else open(args.pol, "r")
 
-policy = Policy(dev, args.rn)
+	policy = Policy(device(args), args.rn)
 
-for line in f:
-	r = PRule(line, args.deny)
-	policy.addrule(r)
+	for line in f:
+		r = PRule(line, args.deny)
+		policy.addrule(r)
 
-policy.rprint()
+	policy.rprint()
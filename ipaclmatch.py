@@ -6,8 +6,22 @@ import string
 import argparse
 import re
 import sys
+import os
+import json
+import mmap
+import array
+import hashlib
+import bisect
+import socket
+from functools import lru_cache
+import io
+import contextlib
+import multiprocessing
 import pprint
 
+from asaports import s2n
+from zfile import compressed, zopen
+
 try:
 	import netaddr
 except ImportError:
@@ -20,76 +34,67 @@ def debug(string, level=1):
 		pprint.pprint(string, sys.stderr, width=70)
 
 
-# True if the IP belongs to the Source IP
-# arr[7] -- source IP-address or host
-# arr[8] -- netmask or hostip
-def issrc(searchip):
-	global srcip, srcmask, dstip, dstmask
-	debug("Is %s in the source?" % str(searchip), 2)
-	dstip = arr[9]
-	dstmask = arr[10]
-	if arr[7] == "0.0.0.0" and args.noany: return False
-	if (args.direct and isdir(searchip, arr[7], arr[8])) or (args.contain and isnetin(searchip, arr[7], arr[8])):
-		srcip = arr[7]
-		srcmask = arr[8]
-		return True
-	elif isinnet(searchip, arr[7], arr[8]):
-		debug("issrc -- Yes, it's in %s/%s" % (arr[7], arr[8]), 2)
-		if args.replace and args.policy and not args.both:
-			srcip = str(searchip.ip)
-			srcmask = str(searchip.netmask)
-		else:
-			srcip = arr[7]
-			srcmask = arr[8]
-		return True
-	else:
-		debug("issrc -- No, it's not in %s/%s" % (arr[7], arr[8]), 2)
-		return False
-
-
-# True if the IP belongs to the Dest IP
-# arr[9] -- dest IP-address or host
-# arr[10] -- netmask or hostip
-def isdst(searchip):
-	global srcip, srcmask, dstip, dstmask
-	debug("Is %s in the destination?" % str(searchip), 2)
-	srcip = arr[7]
-	srcmask = arr[8]
-	if arr[9] == "0.0.0.0" and args.noany: return False
-	if (args.direct and isdir(searchip, arr[9], arr[10])) or (args.contain and isnetin(searchip, arr[9], arr[10])):
-		dstip = arr[9]
-		dstmask = arr[10]
-		return True
-	elif isinnet(searchip, arr[9], arr[10]):
-		debug("isdst -- Yes, it's in %s/%s" % (arr[9], arr[10]), 2)
-		if args.replace and args.policy and not args.both:
-			dstip = str(searchip.ip)
-			dstmask = str(searchip.netmask)
-		else:
-			dstip = arr[9]
-			dstmask = arr[10]
-		return True
-	else:
-		debug("isdst -- No, it's not in %s/%s" % (arr[9], arr[10]), 2)
-		return False
-
-
-# True if there is a direct match
-# Go through all IP's in ips and compare with the ip and mask from the ACL
-def isdir(searchip, ip, mask):
-#	if result and args.verbose:
-#		debug("Direct match found for %s (args) and %s %s (ACL)" % (args.addr, ip,mask) ,2)
-	return str(searchip.ip) == ip and str(searchip.netmask) == mask
-
-
-# Does any of the IP-addresses we are searching for belong to the current IP network?
-def isinnet(searchip, ip, mask):
-	return searchip in netaddr.IPNetwork(ip + "/" + mask)
-
-
-# Does any of the IP-addresses we are searching for contains the current IP network?
-def isnetin(searchip, ip, mask):
-	return netaddr.IPNetwork(ip + "/" + mask) in searchip
+class AddrTrie:
+	"""
+	Binary prefix trie of the IP-addresses we are searching for
+	Every node is a list: [child for bit 0, child for bit 1,
+	indexes of searchips ending in this node, indexes of searchips in this node and below]
+	"""
+
+	def __init__(self, ips):
+		self.root = [None, None, [], []]
+		for i, searchip in enumerate(ips):
+			node = self.root
+			node[3].append(i)
+			for b in range(searchip.prefixlen):
+				bit = (searchip.first >> (31 - b)) & 1
+				if node[bit] is None:
+					node[bit] = [None, None, [], []]
+				node = node[bit]
+				node[3].append(i)
+			node[2].append(i)
+
+	def match(self, addr, plen):
+		"""
+		Walk down to addr/plen once
+		Returns the indexes of searchips containing addr/plen (uppernets),
+		equal to addr/plen, and belonging to addr/plen (including equal ones)
+		"""
+		node = self.root
+		uppers = list(node[2])
+		for b in range(plen):
+			node = node[(addr >> (31 - b)) & 1]
+			if node is None:
+				return uppers, [], []
+			uppers.extend(node[2])
+		return uppers, node[2], node[3]
+
+
+# IP-address and netmask strings to the (network address, prefix length) integers
+# The same networks repeat all over the ACL, hence the cache
+@lru_cache(maxsize=None)
+def str2net(ip, mask):
+	bits = int.from_bytes(socket.inet_aton(mask), 'big')
+	return int.from_bytes(socket.inet_aton(ip), 'big') & bits, bin(bits).count("1")
+
+
+# Which of the IP-addresses we are searching for match the ACL network ip/mask?
+# Returns { index in ips: True if the ACL network should be replaced with the searchip }
+# A searchip matches, if it belongs to the ACL network, or
+# with --direct if it is the same network, or
+# with --contain if it contains the ACL network
+def netmatch(ip, mask):
+	if ip == "0.0.0.0" and args.noany: return {}
+	uppers, equals, inners = trie.match(*str2net(ip, mask))
+	replace = args.replace and args.policy and not args.both
+	found = dict.fromkeys(inners, replace)
+	if args.direct:
+		for i in equals:
+			if str(ips[i].ip) == ip: found[i] = False
+	if args.contain:
+		for i in uppers: found[i] = False
+	debug("netmatch -- %s/%s matches %s" % (ip, mask, [str(ips[i]) for i in sorted(found)]), 2)
+	return found
 
 
 # Postformat the ACL and print
@@ -109,8 +114,18 @@ def print_acl():
 	debug(line, 3)
 	if args.transform:
 		prepsvc()
+		if neq_range and svclow:
+			# Print only the part of the neq split matching --port
+			if not portmatch(*map(int, neq_range.split(":")[1].split("-"))): neq_range = ''
+			if not portmatch(*map(int, service.split(":")[1].split("-"))): service, neq_range = neq_range, ''
 		debug("src= %s/%s dst= %s/%s srv= %s neq_range= %s" % (srcip, srcmask, dstip, dstmask, service, neq_range), 2)
-		if args.policy:
+		if sink is not None:
+			sink(policy_record(service))
+			if neq_range: sink(policy_record(neq_range))
+		elif args.json:
+			print_record(service)
+			if neq_range: print_record(neq_range)
+		elif args.policy:
 			print(srcip, srcmask, dstip, dstmask, service, action)
 			if neq_range: print(srcip, srcmask, dstip, dstmask, neq_range, action)
 		elif args.src:
@@ -126,6 +141,24 @@ def print_acl():
 		print(line.replace('0.0.0.0 0.0.0.0', 'any'))
 
 
+# The policy line as a record with integer addresses
+# {"src": [(addr, prefixlen)], "dst": [(addr, prefixlen)], "srv": [service], "action": "deny"}
+# "action" is present for the deny lines only
+def policy_record(srv):
+	record = {'src': [str2net(srcip, srcmask)], 'dst': [str2net(dstip, dstmask)], 'srv': [srv]}
+	if action: record['action'] = action
+	return record
+
+
+# --json: print the policy line as a JSON record
+def print_record(srv):
+	print(json.dumps(policy_record(srv), separators=(',', ':')))
+
+
+# With --policy, every record is passed to sink instead of being printed, if set (see aclpipe.py)
+sink = None
+
+
 # Replace "host" with IP 255.255.255.255
 def host2num(where):
 	global srcip, srcmask, dstip, dstmask
@@ -204,11 +237,586 @@ def serv2num(f):
 		sys.exit(1)
 
 
+re_any = re.compile(r'\bany\b|\bany4\b')
+
+
+# Clean up an "extended" line of the ACL
+# Returns None for remarks, object-group lines and other leftovers
+def cleanup(line):
+	debug(line, 3)
+	# Remove leftovers
+	if "remark" in line or "object-group" in line or " object " in line or not "extended" in line: return None
+	if "<---" in line: line = line.replace('<--- More --->', '')
+	# remove hit counters
+	i = line.find('(hitcnt')
+	if i >= 0: line = line[:i]
+	# replace all multiple tabs and/or spaces with a single space, and remove logging statements
+	arr = line.split()
+	if 'log' in arr: del arr[arr.index('log'):]
+	line = ' '.join(arr)
+	
+	# Replace any with 0/0
+	if 'any' in line: line = re_any.sub('0.0.0.0 0.0.0.0', line)
+	debug(line, 2)
+	return line
+
+
+# Lines of the ACL file, read through a memory map
+# Remarks, object-group parent lines and other non-"extended" lines are skipped without decoding
+# With prefilter, so are the deny lines with --permit and the permit lines with --deny
+def mmap_lines(acl, prefilter=True):
+	for raw in mmap_raw(acl):
+		if b'extended' not in raw or b'remark' in raw or b'object-group' in raw or b' object ' in raw: continue
+		if prefilter and args.permit and b' extended deny ' in raw: continue
+		if prefilter and args.deny and b' extended permit ' in raw: continue
+		yield raw.decode(errors='replace')
+
+
+# All raw (bytes) lines of the ACL file, read through a memory map, or of the console
+# Compressed files and console input are decompressed on the fly
+def mmap_raw(acl):
+	if acl == "-" or compressed(acl):
+		yield from zopen(acl)
+		return
+	with open(acl, "rb") as fb:
+		if not os.fstat(fb.fileno()).st_size: return
+		with mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			yield from iter(mm.readline, b'')
+
+
+# Cleaned up ACL lines from f (the console or mmap_lines())
+def acl_lines(f):
+	counter = 0
+	for line in f:
+		if args.verbose: counter += 1
+		line = cleanup(line)
+		if line: yield line
+	debug("%d rules in the ACL file" % counter)
+
+
+# Columns of the parsed ACL cache and their array typecodes
+# acl and proto are indexes in the string tables, text is the cleaned up line
+# op is the destination port operator (see port_ops), p1 and p2 are the ports (-1 if unknown)
+# sop, sp1 and sp2 are the same for the source port
+cache_columns = [('acl', 'I'), ('action', 'B'), ('proto', 'I'), ('src', 'I'), ('srcplen', 'B'),
+				 ('dst', 'I'), ('dstplen', 'B'), ('op', 'B'), ('p1', 'i'), ('p2', 'i'),
+				 ('sop', 'B'), ('sp1', 'i'), ('sp2', 'i'), ('text', 'Q')]
+cache_version = 3
+port_ops = {'eq': 1, 'range': 2, 'lt': 3, 'gt': 4, 'neq': 5}
+
+
+# Port number or name to int (-1 if the name is unknown)
+def port2num(port):
+	if re.match(r'\d+', port): return int(port)
+	return int(s2n.get(port, -1))
+
+
+# Parse a cleaned up ACL line into the values of cache_columns (without text)
+# acl and proto are returned as strings
+def ace_fields(line):
+	a = line.split()
+	sop = sp1 = sp2 = 0
+	if a[9] in port_ops:
+		sop = port_ops[a[9]]
+		sp1 = sp2 = port2num(a[10])
+		if sop == port_ops['range']:
+			sp2 = port2num(a[11])
+			del a[11]
+		del a[9:11]
+	src = str2net(a[8], "255.255.255.255") if "host" in a[7] else str2net(a[7], a[8])
+	dst = str2net(a[10], "255.255.255.255") if "host" in a[9] else str2net(a[9], a[10])
+	op = p1 = p2 = 0
+	if len(a) > 11:
+		if "icmp" in a[6]: a.insert(11, "eq")
+		op = port_ops.get(a[11], 0)
+		if op and len(a) > 12: p1 = p2 = port2num(a[12])
+		if op == 2 and len(a) > 13: p2 = port2num(a[13])
+	return [a[1], 1 if "deny" in a[5] else 0, a[6], src[0], src[1], dst[0], dst[1], op, p1, p2, sop, sp1, sp2]
+
+
+# File size, modification time and content hash
+# The cache is valid only if all three are the same
+def file_id(acl):
+	st = os.stat(acl)
+	h = hashlib.blake2b(digest_size=16)
+	with open(acl, "rb") as fb:
+		for chunk in iter(lambda: fb.read(1 << 20), b''):
+			h.update(chunk)
+	return {'size': st.st_size, 'mtime': st.st_mtime_ns, 'digest': h.hexdigest()}
+
+
+# The cache file is: b'ACLC', 4 bytes of the JSON header length, the JSON header,
+# and the columns, every column is aligned to 8 bytes
+def cache_save(acl, fid, cols, strings):
+	header = {'version': cache_version, 'byteorder': sys.byteorder, 'file': fid, 'count': len(cols['acl']),
+			  'strings': strings, 'columns': {}}
+	offset = 0
+	for name, typecode in cache_columns:
+		nbytes = len(cols[name]) * cols[name].itemsize
+		header['columns'][name] = [offset, nbytes]
+		offset += (nbytes + 7) & ~7
+	header['columns']['blob'] = [offset, len(cols['blob'])]
+	hdr = json.dumps(header).encode()
+	hdr += b' ' * (-(len(hdr) + 8) & 7)
+	tmp = acl + ".cache.tmp"
+	try:
+		with open(tmp, "wb") as fc:
+			fc.write(b'ACLC' + len(hdr).to_bytes(4, 'little') + hdr)
+			for name, typecode in cache_columns:
+				fc.write(cols[name].tobytes())
+				fc.write(b'\0' * (-fc.tell() & 7))
+			fc.write(cols['blob'])
+		os.replace(tmp, acl + ".cache")
+	except OSError as e:
+		debug("cache_save -- cannot save the cache: %s" % e, 0)
+
+
+# Memory-map FILE.cache and return (header, columns), or None if there is no valid cache
+# Columns are memoryviews on the mapped file, nothing is copied
+def cache_load(acl, fid):
+	try:
+		with open(acl + ".cache", "rb") as fc:
+			mm = mmap.mmap(fc.fileno(), 0, access=mmap.ACCESS_READ)
+	except (OSError, ValueError):
+		return None
+	if mm[:4] != b'ACLC':
+		return None
+	hlen = int.from_bytes(mm[4:8], 'little')
+	header = json.loads(mm[8:8 + hlen])
+	if header['version'] != cache_version or header['byteorder'] != sys.byteorder or header['file'] != fid:
+		debug("cache_load -- %s.cache is outdated" % acl, 1)
+		return None
+	data = memoryview(mm)[8 + hlen:]
+	cols = {}
+	for name, typecode in cache_columns:
+		offset, nbytes = header['columns'][name]
+		cols[name] = data[offset:offset + nbytes].cast(typecode)
+	offset, nbytes = header['columns']['blob']
+	cols['blob'] = data[offset:offset + nbytes]
+	return header, cols
+
+
+# Cleaned up ACL lines from the ACL file or from its cache (with --cache)
+# With a valid cache, the lines that cannot match the search are dropped by the parsed columns,
+# without decoding the text
+def read_acl(acl):
+	if "-" == acl or not args.cache:
+		yield from acl_lines(mmap_lines(acl))
+		return
+	for fields, line in read_fields(acl, True):
+		yield line
+
+
+# (fields, line) of the ACL file, the fields as returned by ace_fields
+# With --cache, the fields come from the cache. Without a valid cache the file is parsed, and the cache is saved
+# With prefilter, the cached lines that cannot match the search are skipped (see candidate)
+def read_fields(acl, prefilter=False):
+	if "-" == acl or not args.cache:
+		for line in read_acl(acl):
+			yield ace_fields(line), line
+		return
+	fid = file_id(acl)
+	cache = cache_load(acl, fid)
+	if cache:
+		header, cols = cache
+		debug("Reading %d lines from %s.cache" % (header['count'], acl), 1)
+		strings = header['strings']
+		protos = [proto2num(proto) for proto in strings['proto']]
+		names = [name for name, typecode in cache_columns[:-1]]
+		columns = [cols[name] for name in names]
+		text, blob = cols['text'], cols['blob']
+		for i in range(header['count']):
+			fields = [column[i] for column in columns]
+			if prefilter and not candidate(fields, protos): continue
+			fields[0] = strings['acl'][fields[0]]
+			fields[2] = strings['proto'][fields[2]]
+			yield fields, str(blob[text[i]:text[i + 1]], 'utf-8')
+		return
+	cols = {name: array.array(typecode) for name, typecode in cache_columns}
+	strings = {'acl': {}, 'proto': {}}
+	blob = bytearray()
+	for raw in mmap_lines(acl, False):
+		line = cleanup(raw)
+		if not line: continue
+		fields = ace_fields(line)
+		for (name, typecode), value in zip(cache_columns, fields):
+			if name in strings:
+				value = strings[name].setdefault(value, len(strings[name]))
+			cols[name].append(value)
+		cols['text'].append(len(blob))
+		blob += line.encode()
+		if args.deny and not fields[1] or args.permit and fields[1]: continue
+		yield fields, line
+	cols['text'].append(len(blob))
+	cols['blob'] = bytes(blob)
+	cache_save(acl, fid, cols, {name: list(strings[name]) for name in strings})
+
+
+# Can the line with these cached fields match the search?
+# The proto field is the index in the string table, protos are the protocol numbers of the table
+# Only the lines that surely do not match are rejected, the others are checked by scan() as usual
+def candidate(fields, protos):
+	# Permit or deny lines
+	if args.deny and not fields[1]: return False
+	if args.permit and fields[1]: return False
+	if args.flows or args.hits or args.dedup: return True
+	if args.proto and not svcmatch(fields, protos[fields[2]], *fields[7:10]): return False
+	if "0.0.0.0/0" in args.addr and not args.any and not args.noany: return True
+	return (not args.dst and addrmatch(fields[3], fields[4])) or (not args.src and addrmatch(fields[5], fields[6]))
+
+
+# Does netmatch() find anything for the network addr/plen? May return True when it does not (--direct)
+def addrmatch(addr, plen):
+	if args.noany and addr == 0: return False
+	uppers, equals, inners = trie.match(addr, plen)
+	return bool(inners or args.direct and equals or args.contain and uppers)
+
+
+# Take the cleaned up ACL lines, and print the lines matching the criteria
+# If --count, nothing is printed, and the amount of
+# the source and destination matches is returned instead
+def scan(lines, acl="-"):
+	global line, arr, service, neq_range, action, srcip, srcmask, dstip, dstmask
+	cntsrc = 0
+	cntdst = 0
+	seen = AceSet(args.dedup_mem << 20) if args.dedup else None
+	for line in lines:
+		service = ''
+		neq_range = ''
+		arr = line.split()
+		
+		# We are not interested in permit lines, if --deny is set
+		if args.deny and not "deny" in arr[5]: continue
+		
+		# We are not interested in deny lines, if --permit is set
+		if args.permit and "deny" in arr[5]: continue
+		
+		# Explicitly add 'deny' at the end of the policy line
+		if not args.permit and not args.deny and "deny" in arr[5]:
+			action = 'deny'
+		else:
+			action = ''
+		
+		if args.both and args.noany and "0.0.0.0 0.0.0.0" in line: continue
+		
+		if args.proto:
+			f = ace_fields(line)
+			if not svcmatch(line, proto2num(f[2]), *f[7:10]): continue
+		
+		# Source ports are not supported yet, but they are a part of the --dedup key
+		sport = []
+		if "range" in arr[9]:
+			sport = arr[9:12]
+			del arr[9:12]
+		elif "eq" in arr[9] or "lt" in arr[9] or "gt" in arr[9] or "neq" in arr[9]:
+			sport = arr[9:11]
+			del arr[9:11]
+		
+		host2num("src")
+		host2num("dst")
+		
+		# The same element under several lines, e.g. in overlapping object-groups
+		if seen is not None and seen.seen(" ".join(arr[5:9] + sport + arr[9:])): continue
+		
+		if "0.0.0.0/0" in args.addr and not args.any and not args.noany:
+			srcip = arr[7]
+			srcmask = arr[8]
+			dstip = arr[9]
+			dstmask = arr[10]
+			if args.count:
+				cntsrc += 1
+				cntdst += 1
+			else:
+				print_acl()
+		else:
+			srcfound = netmatch(arr[7], arr[8]) if not args.dst else {}
+			dstfound = netmatch(arr[9], arr[10]) if not args.src else {}
+			srcip = arr[7]
+			srcmask = arr[8]
+			dstip = arr[9]
+			dstmask = arr[10]
+			if args.count:
+				# Same as two passes with --src and --dst, but in one go
+				cntsrc += len(srcfound)
+				cntdst += len(dstfound)
+			elif args.src:
+				for i in sorted(srcfound):
+					if srcfound[i]:
+						srcip = str(ips[i].ip)
+						srcmask = str(ips[i].netmask)
+					print_acl()
+			elif args.dst:
+				for i in sorted(dstfound):
+					if dstfound[i]:
+						dstip = str(ips[i].ip)
+						dstmask = str(ips[i].netmask)
+					print_acl()
+			elif args.both:
+				for i in sorted(srcfound.keys() | dstfound.keys()):
+					print_acl()
+		del arr[:]
+	
+	if seen is not None:
+		debug("%s: %d duplicate lines dropped" % (acl, seen.dropped), 0)
+	return cntsrc, cntdst
+
+
+class AceSet:
+	"""
+	Set of the 64-bit hashes of the normalized ACEs for --dedup
+	The hashes are kept in an open addressing table, doubled when 3/4 full up to the memory cap
+	When the largest table is full, new ACEs are not remembered any more, so some duplicates may pass
+	"""
+
+	def __init__(self, size):
+		# The number of slots is a power of two
+		self.maxslots = 1 << max((size // 8).bit_length() - 1, 4)
+		self.resize(min(self.maxslots, 1 << 12))
+		self.used = 0
+		self.dropped = 0
+
+	def resize(self, slots):
+		old = self.table if hasattr(self, 'table') else ()
+		self.slots = slots
+		self.limit = slots * 3 // 4
+		self.table = array.array('Q', bytes(8 * slots))
+		mask = slots - 1
+		for h in old:
+			if not h: continue
+			i = h & mask
+			while self.table[i]: i = (i + 1) & mask
+			self.table[i] = h
+
+	# True if the ACE has been seen before
+	def seen(self, ace):
+		h = hash(ace) & 0xffffffffffffffff or 1
+		table = self.table
+		mask = self.slots - 1
+		i = h & mask
+		while table[i]:
+			if table[i] == h:
+				self.dropped += 1
+				return True
+			i = (i + 1) & mask
+		if self.used < self.limit:
+			table[i] = h
+			self.used += 1
+			if self.used == self.limit:
+				if self.slots < self.maxslots:
+					self.resize(self.slots * 2)
+				else:
+					debug("--dedup-mem is exhausted, new lines are not deduplicated any more", 0)
+		return False
+
+
+# Scan one ACL file in a worker process of the --jobs pool
+# The output is collected and returned to the parent together with the counters
+# The counters are None if the scan has failed (the error is already printed to STDERR)
+def scan_file(acl):
+	buf = io.StringIO()
+	try:
+		with contextlib.redirect_stdout(buf):
+			counters = scan(read_acl(acl), acl)
+	except SystemExit:
+		counters = None
+	return acl, buf.getvalue(), counters
+
+
+masks = [(0xffffffff << (32 - plen)) & 0xffffffff for plen in range(33)]
+proto_nums = {'icmp': 1, 'igmp': 2, 'ipinip': 4, 'tcp': 6, 'udp': 17, 'gre': 47, 'esp': 50, 'ah': 51,
+			  'icmp6': 58, 'eigrp': 88, 'ospf': 89, 'nos': 94, 'pim': 103, 'pcp': 108, 'snp': 109, 'sctp': 132}
+
+
+# Protocol name or number to int ("ip" is None, i.e. any protocol)
+def proto2num(proto):
+	if "ip" == proto: return None
+	if proto.isdigit(): return int(proto)
+	return proto_nums.get(proto, proto)
+
+
+# Destination port operator and ports (see ace_fields) to the list of port intervals
+# with the ASA semantics (lt and gt do not include the port). None means any port
+def port_intervals(line, op, p1, p2):
+	if op and (p1 < 0 or p2 < 0):
+		debug(line, 0)
+		debug("port_intervals -- unknown service", 0)
+		sys.exit(1)
+	if op == port_ops['eq']: return ((p1, p1),)
+	elif op == port_ops['range']: return ((p1, p2),)
+	elif op == port_ops['lt']: return ((0, p1 - 1),)
+	elif op == port_ops['gt']: return ((p1 + 1, 65535),)
+	elif op == port_ops['neq']: return ((0, p1 - 1), (p1 + 1, 65535))
+	return None
+
+
+# Does the service of the ACL line match --proto and --port?
+# proto is the protocol number (see proto2num), op, p1 and p2 are the destination port fields (see ace_fields)
+# "ip" lines match any protocol, lines without ports match any port
+# The --port intervals are sorted and merged in svclow and svchigh
+def svcmatch(line, proto, op, p1, p2):
+	if proto is not None and svcproto is not None and proto != svcproto: return False
+	if not svclow: return True
+	ports = port_intervals(line, op, p1, p2)
+	if ports is None: return True
+	for low, high in ports:
+		if portmatch(low, high): return True
+	return False
+
+
+# Does the low-high port interval overlap with any --port interval?
+def portmatch(low, high):
+	i = bisect.bisect_right(svclow, high) - 1
+	return i >= 0 and svchigh[i] >= low
+
+
+class FlowTable:
+	"""
+	First-match lookup of flows (src, dst, proto, port, source port) in one ACL
+	The ACEs are kept in a hierarchy of hashes:
+	source prefix length -> source network -> destination prefix length -> destination network ->
+	[(ACE number, protocol, port intervals, source port intervals), ...] sorted by the ACE number
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.src = {}
+		self.lines = []
+
+	def add(self, f, line):
+		"""
+		Compile a cleaned up ACL line and its fields (see ace_fields)
+		"""
+		ports = port_intervals(line, *f[7:10])
+		sports = port_intervals(line, *f[10:13])
+		dsts = self.src.setdefault(f[4], {}).setdefault(f[3], {})
+		dsts.setdefault(f[6], {}).setdefault(f[5], []).append((len(self.lines), proto2num(f[2]), ports, sports))
+		self.lines.append(line)
+
+	def lookup(self, src, dst, proto, port, sport=None):
+		"""
+		Returns the first ACL line matching the flow, or None
+		port is None, if the flow has no port
+		sport is None, if the source port is unknown. Then the lines with a source port never match
+		"""
+		best = len(self.lines)
+		for srcplen, srcnets in self.src.items():
+			dsts = srcnets.get(src & masks[srcplen])
+			if dsts is None: continue
+			for dstplen, dstnets in dsts.items():
+				aces = dstnets.get(dst & masks[dstplen])
+				if aces is None: continue
+				for i, aceproto, ports, sports in aces:
+					if i >= best: break
+					if aceproto is not None and aceproto != proto: continue
+					if sports is not None and (sport is None or not any(low <= sport <= high for low, high in sports)):
+						continue
+					if ports is None or (port is not None and any(low <= port <= high for low, high in ports)):
+						best = i
+						break
+		return self.lines[best] if best < len(self.lines) else None
+
+
+# Compile the ACLs and print the file and the first matching line for every flow in args.flows
+# A flow is "src dst proto", "src dst proto:port" or "src dst proto:port sport"
+# Every file has its own tables, as the same ACL name on different firewalls is a different ACL
+def lookup_flows():
+	tables = {}
+	for acl in args.acl:
+		debug("Compiling " + acl)
+		for fields, line in read_fields(acl):
+			if " inactive" in line: continue
+			key = (acl, fields[0])
+			if key not in tables: tables[key] = FlowTable(fields[0])
+			tables[key].add(fields, line)
+	f = sys.stdin if "-" == args.flows else open(args.flows, "r")
+	for flow in f:
+		flow = flow.split()
+		if not flow or flow[0].startswith("#"): continue
+		if len(flow) < 3:
+			debug(flow, 0)
+			debug("lookup_flows -- expected: src dst proto[:port] [sport]", 0)
+			sys.exit(1)
+		src = int.from_bytes(socket.inet_aton(flow[0]), 'big')
+		dst = int.from_bytes(socket.inet_aton(flow[1]), 'big')
+		proto, port = flow[2].split(":") if ":" in flow[2] else [flow[2], None]
+		port = port2num(port) if port else None
+		sport = port2num(flow[3]) if len(flow) > 3 else None
+		for (acl, name), table in tables.items():
+			line = table.lookup(src, dst, proto2num(proto), port, sport)
+			line = line.replace('0.0.0.0 0.0.0.0', 'any') if line else "access-list %s implicit deny" % name
+			print(" ".join(flow[:4]), acl, line)
+	f.close()
+
+
+# The (inactive) mark of the inactive and time-range inactive lines is not a part of the rule
+re_rule = re.compile(r'access-list\s+(\S+)\s+line\s+(\d+)\s+extended\s+(.*?)\s*(?:\(hitcnt=(\d+)\))?\s*(?:\(inactive\))?'
+					 r'\s*(0x[0-9a-fA-F]+)?\s*$')
+
+
+# Hit counters of the ACL file aggregated per rule (ACL name and line number)
+# Returns a dict {(acl, line): [hits, elements, rule hash, rule]}
+# Only one entry per rule is kept in memory, not one per element
+# The hits of a rule with object-groups are the sum of the hits of its elements
+def rule_hits(acl):
+	rules = {}
+	for raw in mmap_raw(acl):
+		if b' extended ' not in raw: continue
+		m = re_rule.search(raw.decode(errors='replace'))
+		if not m: continue
+		name, lnum, rule, hitcnt, rulehash = m.groups()
+		hitcnt = int(hitcnt) if hitcnt else 0
+		key = (name, int(lnum))
+		entry = rules.get(key)
+		if entry is None:
+			# The parent line, or the only line of a rule without object-groups
+			rules[key] = [hitcnt, 0, rulehash, " ".join(rule.split())]
+		elif entry[1] == 0:
+			# The first element replaces the hits of the parent line
+			entry[0] = hitcnt
+			entry[1] = 1
+		else:
+			entry[0] += hitcnt
+			entry[1] += 1
+	for entry in rules.values():
+		if not entry[1]: entry[1] = 1
+	return rules
+
+
+# --hits: rank the rules by hits, or by the new hits since the --since snapshot
+# The rules are kept per file, as the same ACL name on different firewalls is a different ACL
+def print_hits():
+	rules = {}
+	for acl in args.acl:
+		debug("Reading from " + acl)
+		for key, entry in rule_hits(acl).items():
+			rules[(acl,) + key] = entry
+	if args.since:
+		old = rule_hits(args.since)
+		# Rules are matched by the rule hash, as the line numbers change when rules are added or removed
+		oldhash = {entry[2]: entry for entry in old.values() if entry[2]}
+		seconds = 0
+		if "-" not in args.acl:
+			seconds = max(os.stat(acl).st_mtime for acl in args.acl) - os.stat(args.since).st_mtime
+		for key, entry in rules.items():
+			prev = oldhash.get(entry[2]) if entry[2] else old.get(key[1:])
+			delta = entry[0] - prev[0] if prev else entry[0]
+			# The counters were cleared between the snapshots
+			if delta < 0: delta = entry[0]
+			entry[0] = delta
+	for key, entry in sorted(rules.items(), key=lambda item: -item[1][0]):
+		fields = [entry[0]]
+		if args.since:
+			fields.append("%.3f" % (entry[0] / seconds) if seconds > 0 else "-")
+		print(*fields, *key, entry[1], entry[3])
+
+
 parser = argparse.ArgumentParser()
-parser.add_argument('-a', '--addr', default='0.0.0.0/0',
-					help="Comma-separated list of addresses/netmasks. \"all\" shows all lines")
-parser.add_argument('acl', default="-", nargs='?',
-					help="Cisco ASA ACL filename or \"-\" to read from the console (default)")
+ad = parser.add_mutually_exclusive_group()
+ad.add_argument('-a', '--addr', default='0.0.0.0/0',
+				help="Comma-separated list of addresses/netmasks. \"all\" shows all lines")
+ad.add_argument('--addr-file', help="File with addresses/netmasks, one per line")
+parser.add_argument('acl', default=["-"], nargs='*',
+					help="Cisco ASA ACL filenames or \"-\" to read from the console (default)")
 parser.add_argument('-v', '--verbose', default=0,
 					help='Verbose mode. Messages are sent to STDERR.\n To increase the level add "v", e.g. -vvv',
 					action='count')
@@ -216,6 +824,9 @@ sd = parser.add_mutually_exclusive_group()
 sd.add_argument('-s', '--src', help="Search the source", action="store_true")
 sd.add_argument('-d', '--dst', help="Search the destination", action="store_true")
 sd.add_argument('-b', '--both', help="Search both the source and the destination (default)", action="store_true")
+sd.add_argument('-c', '--count',
+				help="Print the amount of matching lines in the source and in the destination per ACL file",
+				action="store_true")
 an = parser.add_mutually_exclusive_group()
 an.add_argument('--noany', help="Ignore \'any\' in the ACLs", action="store_true")
 an.add_argument('--any', help="Show only \'any\' in the ACLs", action="store_true")
@@ -237,116 +848,137 @@ parser.add_argument('-r', '--replace',
 parser.add_argument('-p', '--policy',
 					help='Print the policy in the form:\n SourceIP SourceMask DestIP DestMask Proto:Port. Must be used with either --deny or --permit',
 					action="store_true")
+parser.add_argument('--json',
+					help='With --policy, print JSON records with integer addresses instead of the text lines. \
+	Accepted by optimacl.py and genacl.py', action="store_true")
 parser.add_argument('--contain',
 					help='Direct matches and subnets (not direct and uppernets). Assumes --noany',
 					action="store_true")
 parser.add_argument('--noline', help='Removes line numbers from the output', action="store_true")
-args = parser.parse_args()
+parser.add_argument('--proto', help='Search only lines allowing (or denying) the protocol, e.g. tcp, udp, icmp or 47')
+parser.add_argument('--port',
+					help='Comma-separated list of ports and port ranges, e.g. 445,135-139. Must be used with --proto')
+parser.add_argument('--flows',
+					help='File with flows (src dst proto[:port] [sport] per line) or "-" for the console. \
+	Print the first ACL line matching every flow. Without sport, the lines with a source port are skipped. All lines of the ACL are used, --permit and --deny are ignored')
+parser.add_argument('--cache',
+					help='Save the parsed ACL in ACL.cache and use it while the ACL file is unchanged',
+					action="store_true")
+parser.add_argument('--dedup',
+					help='Drop the lines repeating an already seen line (same action, protocol, addresses and ports), \
+	e.g. the same element in several lines with overlapping object-groups. The amount is printed to STDERR',
+					action="store_true")
+parser.add_argument('--dedup-mem', default=64, type=int,
+					help='Memory cap for --dedup in MB (default 64, enough for ~6M unique lines)')
+parser.add_argument('--hits',
+					help='Rank the rules (lines) of the ACLs by the sum of the hit counters of their elements. \
+	Print: hits file ACL line elements rule', action="store_true")
+parser.add_argument('--since',
+					help='With --hits, rank by the hits since the given earlier snapshot of the ACL. \
+	Print: hits hits/s file ACL line elements rule')
+parser.add_argument('-j', '--jobs', default=1, type=int,
+					help='Scan up to JOBS ACL files in parallel. The output is the same as with one job')
+
+# Check and complete the options, compile the addresses and services to search for
+# Called once before scanning: by the main program and by aclpipe.py. The --jobs workers use init_worker()
+def setup(options):
+	global args
+	args = options
+
+	if not args.src and not args.dst and not args.both and not args.count: args.both = True
+	if args.addr_file:
+		with open(args.addr_file, "r") as af:
+			args.addr = ",".join(l.strip() for l in af if l.strip() and not l.lstrip().startswith("#"))
+	if "all" in args.addr or "any" in args.addr: args.addr = "0.0.0.0/0"
+	if "0.0.0.0/0" in args.addr and not args.any: args.contain = True
+	if args.both and args.transform:
+		debug("--transform requires either --src or --dst. --transform cannot be used with --both", 0)
+		sys.exit(1)
+	if args.policy: args.transform = True
+	if args.both and args.direct:
+		debug("--direct requires either --src or --dst. --both cannot be used with --direct", 0)
+		sys.exit(1)
 
-if not args.src and not args.dst and not args.both: args.both = True
-if "all" in args.addr or "any" in args.addr: args.addr = "0.0.0.0/0"
-if "0.0.0.0/0" in args.addr and not args.any: args.contain = True
-if args.both and args.transform:
-	debug("--transform requires either --src or --dst. --transform cannot be used with --both", 0)
-	sys.exit(1)
-if args.policy: args.transform = True
-if args.both and args.direct:
-	debug("--direct requires either --src or --dst. --both cannot be used with --direct", 0)
-	sys.exit(1)
+	if args.norange: args.range = False
+	if args.json and not args.policy:
+		debug("--json requires --policy", 0)
+		sys.exit(1)
+	if args.port and not args.proto:
+		debug("--port requires --proto", 0)
+		sys.exit(1)
+	if args.flows:
+		args.permit = args.deny = False
+	if args.since and not args.hits:
+		debug("--since requires --hits", 0)
+		sys.exit(1)
+	if args.jobs > 1 and "-" in args.acl:
+		debug("--jobs cannot be used to read from the console", 0)
+		sys.exit(1)
+	if args.dedup_mem <= 0:
+		debug("--dedup-mem must be greater than 0", 0)
+		sys.exit(1)
+	compile_search()
 
-if args.norange: args.range = False
-
-# service name - port mapping from
-# http://www.cisco.com/c/en/us/td/docs/security/asa/asa96/configuration/general/asa-96-general-config/ref-ports.html#ID-2120-000002b8
-if args.transform:
-	s2n = {'domain': '53', 'sunrpc': '111', 'citrix-ica': '1494', 'telnet': '23', 'tftp': '69', 'syslog': '514',
-		   'rtsp': '554', 'secureid-udp': '5510', 'gopher': '70', 'h323': '1720', 'echo': '7', 'netbios-ssn': '139',
-		   'snmptrap': '162', 'rpc': '111', 'radius': '1645', 'pcanywhere-data': '5631', 'nameserver': '42',
-		   'rsh': '514', 'sqlnet': '1521', 'uucp': '540', 'ftp': '21', 'sip': '5060', 'whois': '43', 'smtp': '25',
-		   'ctiqbe': '2748', 'hostname': '101', 'snmp': '161', 'mobile-ip': '434', 'daytime': '13', 'ldaps': '636',
-		   'isakmp': '500', 'netbios-dgm': '138', 'finger': '79', 'https': '443', 'ldap': '389', 'kshell': '544',
-		   'irc': '194', 'nntp': '119', 'biff': '512', 'http': '80', 'cifs': '3020', 'exec': '512', 'pptp': '1723',
-		   'ntp': '123', 'aol': '5190', 'talk': '517', 'pcanywhere-status': '5632', 'pop3': '110', 'pop2': '109',
-		   'ftp-data': '20', 'lotusnotes': '1352', 'rip': '520', 'xdmcp': '177', 'pim-auto-rp': '496', 'login': '513',
-		   'dnsix': '195', 'ident': '113', 'netbios-ns': '137', 'kerberos': '750', 'tacacs': '49', 'who': '513',
-		   'cmd': '514', 'bootps': '67', 'bgp': '179', 'nfs': '2049', 'klogin': '543', 'chargen': '19', 'www': '80',
-		   'time': '37', 'discard': '13', 'imap4': '143', 'lpd': '515', 'bootpc': '68', 'radius-acct': '1646',
-		   'ssh': '22', 'redirect': '5', 'information-reply': '16', 'alternate-address': '6', 'mask-reply': '18',
-		   'timestamp-request': '13', 'router-solicitation': '10', 'mobile-redirect': '32', 'parameter-problem': '12',
-		   'echo': '8', 'timestamp-reply': '14', 'conversion-error': '31', 'information-request': '15',
-		   'unreachable': '3', 'echo-reply': '0', 'source-quench': '4', 'mask-request': '17', 'time-exceeded': '11',
-		   'router-advertisement': '9'}
-
-ips = []
-
-# If a list of IP's is given, add them all
-if "," in args.addr:
-	for i in args.addr.split(","):
-		ips.append(netaddr.IPNetwork(i))
-else:
-	ips.append(netaddr.IPNetwork(args.addr))
-
-f = sys.stdin if "-" == args.acl else open(args.acl, "r")
-debug("Reading from " + args.acl)
-counter = 0
-
-for line in f:
-	if args.verbose: counter += 1
-	arr = []
-	service = ''
-	neq_range = ''
-	debug(line, 3)
-	# Remove leftovers
-	if "remark" in line or "object-group" in line or " object " in line or not "extended" in line: continue
-	line = re.sub(r'\s+', ' ', line)  # replace all multiple tabs and.or spaces with a single space
-	line = re.sub(r'\(hitcnt.*$|\s+log\s+.*$|\s+log$', '', line)  # remove hit counters and logging statements
-	line = line.replace(r'<--- More --->', '')
-	line = line.strip()
-	
-	# Replace any with 0/0
-	line = re.sub(r'\bany\b|\bany4\b', '0.0.0.0 0.0.0.0', line)
-	debug(line, 2)
-	arr = line.split()
-	
-	# We are not interested in permit lines, if --deny is set
-	if args.deny and not "deny" in arr[5]: continue
-	
-	# We are not interested in deny lines, if --permit is set
-	if args.permit and "deny" in arr[5]: continue
-	
-	# Explicitly add 'deny' at the end of the policy line
-	if not args.permit and not args.deny and "deny" in arr[5]:
-		action = 'deny'
-	else:
-		action = ''
-	
-	if args.both and args.noany and "0.0.0.0 0.0.0.0" in line: continue
-	
-	# Source ports are not supported yet
-	if "range" in arr[9]: del arr[9:12]
-	if "eq" in arr[9] or "lt" in arr[9] or "gt" in arr[9] or "neq" in arr[9]:
-		del arr[9:11]
-	
-	host2num("src")
-	host2num("dst")
-	
-	if "0.0.0.0/0" in args.addr and not args.any and not args.noany:
-		srcip = arr[7]
-		srcmask = arr[8]
-		dstip = arr[9]
-		dstmask = arr[10]
-		print_acl()
-	else:
-		for searchip in ips:
-			debug("Searching for %s" % str(searchip), 2)
-			if args.src:
-				if issrc(searchip): print_acl()
-			elif args.dst:
-				if isdst(searchip): print_acl()
-			elif args.both:
-				if issrc(searchip) or isdst(searchip): print_acl()
-	del arr[:]
 
-debug("%d rules in the ACL file" % counter)
+# Initializer of the --jobs pool workers
+# The options are already checked and completed by setup() in the parent, so they are only compiled
+def init_worker(options):
+	global args
+	args = options
+	compile_search()
+
 
-f.close()
+# Compile the addresses, --proto and --port of the search
+def compile_search():
+	global ips, trie, svcproto, svclow, svchigh
+	ips = []
+
+	# If a list of IP's is given, add them all
+	if "," in args.addr:
+		for i in args.addr.split(","):
+			ips.append(netaddr.IPNetwork(i))
+	else:
+		ips.append(netaddr.IPNetwork(args.addr))
+
+	# All addresses are compiled in one trie
+	trie = AddrTrie(ips)
+
+	# --proto and --port
+	svcproto = proto2num(args.proto) if args.proto else None
+	svclow = []
+	svchigh = []
+	if args.port:
+		ports = []
+		for port in args.port.split(","):
+			low, high = port.split("-") if "-" in port else [port, port]
+			ports.append(port_intervals(args.port, port_ops['range'], port2num(low), port2num(high))[0])
+		# Merge overlapping and adjacent intervals
+		for low, high in sorted(ports):
+			if svclow and low <= svchigh[-1] + 1:
+				svchigh[-1] = max(svchigh[-1], high)
+			else:
+				svclow.append(low)
+				svchigh.append(high)
+
+
+if __name__ == '__main__':
+	setup(parser.parse_args())
+	if args.hits:
+		print_hits()
+	elif args.flows:
+		lookup_flows()
+	elif args.jobs > 1 and len(args.acl) > 1:
+		# imap returns the results in the order of the files
+		with multiprocessing.Pool(min(args.jobs, len(args.acl)), init_worker, (args,)) as pool:
+			for acl, output, counters in pool.imap(scan_file, args.acl):
+				sys.stdout.write(output)
+				if counters is None:
+					sys.exit(1)
+				if args.count:
+					print(acl, *counters)
+	else:
+		for acl in args.acl:
+			debug("Reading from " + acl)
+			cntsrc, cntdst = scan(read_acl(acl), acl)
+			if args.count:
+				print(acl, cntsrc, cntdst)
@@ -4,8 +4,10 @@ import string
 import argparse
 import re
 import sys
-from operator import itemgetter
-from itertools import groupby
+import json
+import socket
+from collections import namedtuple
+from functools import lru_cache
 
 try:
 	import netaddr
@@ -63,61 +65,162 @@ def check_line():
 			sys.exit(1)
 
 
-# Range (port1-port2) to range (port1, port+1, ... port2)
-# srv is a port list, e.g. ["1000", "2000"]
-def rtor(arr, srv):
-	for i in range(int(srv[0]), int(srv[1]) + 1):
-		arr.append(i)
-
-
-# Add ports to the port array
-def srvadd(port, arr):
+# Port (port1) or range (port1-port2) to the (port1, port2) interval
+def port2range(port):
 	if "-" in port:
-		rtor(arr, port.split("-"))
-	else:
-		arr.append(int(port))
+		low, high = port.split("-")
+		return int(low), int(high)
+	return int(port), int(port)
 
 
-# Sort all ports, remove duplicates, and group in continuous ranges
-# The explanation how it works is here:
-# http://stackoverflow.com/questions/2154249/identify-groups-of-continuous-numbers-in-a-list
-# https://docs.python.org/2.6/library/itertools.html#examples
+# Sort all port intervals, and merge overlapping and adjacent ones
+# The ports are never expanded, so tcp:1-65535 costs the same as tcp:80
 def squeeze(arr):
-	srvarr = []
 	ranges = []
-	for port in arr:
-		srvadd(port, srvarr)
-	# 	for k, g in groupby(enumerate(sorted(set(srvarr))), lambda (x, y): x - y): - original for Python2
-	for k, g in groupby(enumerate(sorted(set(srvarr))), lambda x: x[0] - x[1]):
-		group = (map(itemgetter(1), g))
-		group = list(map(int, group))
-		if group[0] == group[-1]:
-			ranges.append(str(group[0]))
+	for low, high in sorted(map(port2range, arr)):
+		if ranges and low <= ranges[-1][1] + 1:
+			if high > ranges[-1][1]:
+				ranges[-1][1] = high
 		else:
-			ranges.append(str(group[0]) + "-" + str(group[-1]))
-	return ranges
-
-
-# Check if net1->net2 is netlist
-#
-def are_nets_in(net1, net2, netlist):
-	for net in netlist:
-		if type(netlist[net]) is list or type(netlist[net]) is tuple:
-			for n in netlist[net]:
-				if type(net) is tuple or type(net) is list:
-					for m in net:
-						if net1 in m and net2 in n:
-							debug("are_nets_in -- %s is in %s, %s is in %s" % (str(net1), str(m), str(net2), str(n)), 4)
-							return True
-				else:
-					if net1 in net and net2 in n:
-						debug("are_nets_in -- Not list. %s is in %s, %s is in %s" % (
-							str(net1), str(net), str(net2), str(n)), 4)
-						return True
+			ranges.append([low, high])
+	return [str(low) if low == high else str(low) + "-" + str(high) for low, high in ranges]
+
+
+class Net(namedtuple('Net', ['first', 'prefixlen'])):
+	"""
+	Compact IPv4 network: (network address as int, prefix length)
+	Hashed, compared and sorted as a plain tuple.
+	netaddr.IPNetwork is created only to print the network
+	"""
+	__slots__ = ()
+
+	def __str__(self):
+		return str(netaddr.IPNetwork(self))
+
+	def __repr__(self):
+		return "Net('%s')" % str(self)
+
+	@property
+	def last(self):
+		return self.first | (0xffffffff >> self.prefixlen)
+
+
+# Convert IP-address and netmask strings to Net
+# The result is cached, since the same networks repeat all over the policy
+# Raises ValueError for an invalid address or netmask, the caller reports the line
+@lru_cache(maxsize=None)
+def str2net(ip, mask):
+	try:
+		addr = int.from_bytes(socket.inet_aton(ip), 'big')
+		bits = int.from_bytes(socket.inet_aton(mask), 'big')
+	except OSError:
+		bits = -1
+	plen = 32 - (~bits & 0xffffffff).bit_length()
+	if bits != (0xffffffff << (32 - plen)) & 0xffffffff:
+		raise ValueError("%s %s is not a valid IP-address and netmask" % (ip, mask))
+	return Net(addr & bits, plen)
+
+
+# [addr, prefixlen] from a JSON record to Net
+# Cached, so the same networks share one object as with str2net()
+@lru_cache(maxsize=None)
+def int2net(addr, plen):
+	return Net(addr & (0xffffffff << (32 - plen)) & 0xffffffff, plen)
+
+
+# Merge a list of Net's into the shortest sorted list of Net's covering the same addresses
+# Same as netaddr.cidr_merge, but on the (first, last) integer intervals
+def cidr_merge(nets):
+	ranges = []
+	for net in sorted(nets):
+		if ranges and net.first <= ranges[-1][1] + 1:
+			if net.last > ranges[-1][1]:
+				ranges[-1][1] = net.last
 		else:
-			if net1 in net and net2 in netlist[net]:
-				debug("are_nets_in -- %s is in %s, %s is in %s" % (str(net1), str(net), str(net2), str(netlist[net])), 4)
-				return True
+			ranges.append([net.first, net.last])
+	merged = []
+	for first, last in ranges:
+		while first <= last:
+			# The largest block aligned on first, that does not go past last
+			size = first & -first if first else 1 << 32
+			while size > last - first + 1:
+				size >>= 1
+			merged.append(Net(first, 33 - size.bit_length()))
+			first += size
+	return merged
+
+
+class NetTrie:
+	"""
+	Binary prefix trie of IPv4 networks
+	Every node is a list: [child for bit 0, child for bit 1, value]
+	value is None for the transit nodes
+	"""
+
+	def __init__(self):
+		self.root = [None, None, None]
+
+	def setdefault(self, addr, plen, value):
+		"""
+		Same as dict.setdefault: returns the value stored for addr/plen,
+		or stores and returns value, if addr/plen is not in the trie yet
+		addr (int) - network address, plen (int) - prefix length
+		"""
+		node = self.root
+		for i in range(plen):
+			bit = (addr >> (31 - i)) & 1
+			if node[bit] is None:
+				node[bit] = [None, None, None]
+			node = node[bit]
+		if node[2] is None:
+			node[2] = value
+		return node[2]
+
+	def covering(self, addr, plen):
+		"""
+		Yield the values of all networks containing addr/plen (including addr/plen itself)
+		from the shortest prefix to the longest one
+		"""
+		node = self.root
+		if node[2] is not None:
+			yield node[2]
+		for i in range(plen):
+			node = node[(addr >> (31 - i)) & 1]
+			if node is None:
+				return
+			if node[2] is not None:
+				yield node[2]
+
+	def contains(self, addr, plen):
+		"""
+		True if addr/plen belongs to any network in the trie
+		"""
+		for value in self.covering(addr, plen):
+			return True
+		return False
+
+
+# Load the result of group_nets() into a two-dimensional trie:
+# the source networks trie, every node of which holds a trie of the destination networks
+# nets := { (src1, src2, ...): [dst1, dst2, ...], ...}
+def star_trie(nets):
+	trie = NetTrie()
+	for srcs in nets:
+		for src in srcs:
+			dsttrie = trie.setdefault(src.first, src.prefixlen, NetTrie())
+			for dst in nets[srcs]:
+				dsttrie.setdefault(dst.first, dst.prefixlen, True)
+	return trie
+
+
+# Check if net1->net2 is covered by any src->dst pair in the trie
+# Walks down the source trie, and for every source network net1 belongs to
+# walks down the corresponding destination trie
+def are_nets_in(net1, net2, trie):
+	for dsttrie in trie.covering(net1.first, net1.prefixlen):
+		if dsttrie.contains(net2.first, net2.prefixlen):
+			debug("are_nets_in -- %s -> %s is in star_nets" % (str(net1), str(net2)), 4)
+			return True
 	return False
 
 
@@ -162,7 +265,7 @@ def group_nets(nets):
 		debug(src, 5)
 		debug("group_nets -- 1F The destination", 5)
 		debug(nets[src], 5)
-		nets[src] = netaddr.cidr_merge(nets[src])
+		nets[src] = cidr_merge(nets[src])
 		debug("group_nets -- 1F After CIDR-merge", 5)
 		debug(nets[src], 5)
 		if len(nets) == 1:
@@ -191,7 +294,7 @@ def group_nets(nets):
 		debug(dst, 5)
 		debug("group_nets -- The corresponfing sources", 5)
 		debug(revnets[dst], 5)
-		revnets[dst] = netaddr.cidr_merge(revnets[dst])
+		revnets[dst] = cidr_merge(revnets[dst])
 		debug("group_nets -- 2F After CIDR-merge", 5)
 		debug(revnets[dst], 5)
 		add_net_pair(tuple(revnets[dst]), dst, nets)
@@ -202,34 +305,10 @@ def group_nets(nets):
 	return nets
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('pol', default="-", nargs='?', help="Firewall policy or \"-\" (default) to read from the console")
-# parser.add_argument('--group', help='Group services and networks together', action="store_true")
-parser.add_argument('-v', '--verbose', default=0,
-					help='Verbose mode. Messages are sent to STDERR.\n To increase the level add "v", e.g. -vvv',
-					action='count')
-parser.add_argument('--nomerge', help='Do not merge ports', action="store_true")
-args = parser.parse_args()
-
-services = {}  # { service: { srcnet: [dstnet1, dstnet2, ...] }, ... }
-policy = {}  #
-star_nets = {}  # { [srcnet1, srcnet2, ...]: [dstnet1, dstnet2, ...], ... }
-mode = ''  # True if addr srv, False if addr1 addr2 srv
-
-f = sys.stdin if "-" == args.pol else open(args.pol, "r")
-debug("Reading from " + args.pol)
-
-counter = 0
 # First iteration
-# Create star_nets
-# Create policy { (src1,dst1): {proto1:[port_list], proto2:[port_list]}, ... }
-# Fix services, then fix srcnet, and aggregate dstnet
-for line in f:
-	if args.verbose: counter += 1
-	check_line()
-	srcaddr, srcmask, dstaddr, dstmask, service = line.split()
-	srcnet = netaddr.IPNetwork(srcaddr + "/" + srcmask)
-	dstnet = netaddr.IPNetwork(dstaddr + "/" + dstmask)
+# Add the src, dst, service rule to policy { (src1,dst1): {proto1:[port_list], proto2:[port_list]}, ... }
+# and to star_nets if the service is *
+def add_rule(srcnet, dstnet, service, policy, star_nets):
 	if "*" in service:
 		debug("New star_net pair found", 4)
 		debug(srcnet, 4)
@@ -247,95 +326,181 @@ for line in f:
 	if port and port not in policy[pair][proto]:
 		policy[pair][proto].append(port)
 
-debug("%d rules in the policy file" % counter)
-debug("First iteration is completed. %d rules, and %d \"allow all\" rules found" % (len(policy), len(star_nets)))
-debug(policy, 3)
-
-star_nets = group_nets(star_nets)
-debug("Allow rules are reduced to %d" % len(star_nets))
-debug("Second ineration begins")
-
-# Second iteration
-# Combine services together and remove overlaps
-# Iterating over policy.keys(), because some entries will be removed from policy
-# for pair in policy.keys() - was working fir Python2
-# For Python3 - explanation  here:
-# https://stackoverflow.com/questions/11941817/how-to-avoid-runtimeerror-dictionary-changed-size-during-iteration-error
-
-for pair in list(policy):
-	# If the servie is ip * - delete this line
-	if 'ip' in policy[pair] and '*' in policy[pair]['ip']:
-		debug("Removing *", 4)
-		debug(pair, 4)
-		debug(policy[pair], 4)
-		del policy[pair]
-	# Testing src, dst against star_nets
-	# is the slowest part of the program
-	elif are_nets_in(pair[0], pair[1], star_nets):
-		debug("Removing networks matching star_nets", 4)
-		debug(pair, 4)
-		debug(policy[pair], 4)
-		del policy[pair]
-	else:
-		for proto in policy[pair]:
-			if len(policy[pair][proto]) > 1:
-				# First combine all TCP/UDP services
-				if ("tcp" in proto or "udp" in proto) and not args.nomerge:
-					policy[pair][proto] = squeeze(policy[pair][proto])
-		tmparr = policy[pair]
-		policy[pair] = []
-		for proto in tmparr:
-			if tmparr[proto]:
-				for port in tmparr[proto]:
-					policy[pair].append(proto + ":" + port)
-			else:
-				policy[pair].append(proto)
-
-debug("Second iteration is completed. %d rules left" % len(policy))
-debug(policy, 3)
-
-# Third iteration is to create a list of networks per allowed service
-# From policy to services
-# policy is a dict of IPNetwork: [ port_list]
-# services is a dict of Service: list(IPNetworks)
-for pair in policy:
-	for srv in policy[pair]:
-		if srv not in services.keys():
-			services[srv] = {}
-		add_net_pair(pair[0], pair[1], services[srv])
-
-debug("Third iteration is completed. %d services are in the policy" % len(services))
-
-policy = {}
-debug(services, 3)
-
-# Fourth iteration
-for srv in services:
-	# Grouping SRC and DST networks per service
-	services[srv] = group_nets(services[srv])
-	# Grouping services together, based on the same src-dst pairs
-	# All indexes must be immutable, hence converting to tuples
-	# separately, src (keys) and dst (values) per srv
-	for src in services[srv]:
-		add_srv(srv, (src, tuple(services[srv][src])), policy)
-
-debug("Fourth iteration is completed. %d rules in the policy, plus %d \"allow all\" rules" % (len(policy), len(star_nets)))
-debug("Modified services", 3)
-debug(services, 3)
-debug("Resulting policy")
-# print "Finished grouping service nets"
-debug(policy, 3)
-
-for nets in policy:
-	src = ",".join(map(lambda x: str(x), nets[0]))
-	dst = ",".join(map(lambda x: str(x), nets[1]))
-	srv = ",".join(policy[nets])
-	print(src, dst, srv)
-
-if len(star_nets):
+
+# Policy lines (text or JSON records) to the (srcnet, dstnet, service) rules
+def read_policy(f):
+	global line
+	counter = 0
+	for line in f:
+		counter += 1
+		if line.startswith("{"):
+			yield from record_rules(json.loads(line))
+			continue
+		check_line()
+		srcaddr, srcmask, dstaddr, dstmask, service = line.split()
+		try:
+			srcnet, dstnet = str2net(srcaddr, srcmask), str2net(dstaddr, dstmask)
+		except ValueError as e:
+			debug(line, 0)
+			debug(str(e), 0)
+			sys.exit(1)
+		yield srcnet, dstnet, service
+	debug("%d rules in the policy file" % counter)
+
+
+# Record (ipaclmatch.py --json or ipaclmatch.sink) to the (srcnet, dstnet, service) rules
+# The addresses are already integers, no string parsing is needed
+def record_rules(record):
+	global mode
+	if record.get('action', 'permit') != 'permit':
+		debug(record, 0)
+		debug("Only permit rules are expected", 0)
+		sys.exit(1)
+	if mode is True:
+		debug(record, 0)
+		debug("Inconsistency discovered. JSON records cannot be mixed with the 3-field lines", 0)
+		sys.exit(1)
+	mode = False
+	for src in record['src']:
+		for dst in record['dst']:
+			for service in record['srv']:
+				yield int2net(*src), int2net(*dst), service
+
+
+# Iterations 2-4 on the policy and star_nets filled by add_rule()
+# Returns the optimized policy { ((src1, src2, ...), (dst1, dst2, ...)): [srv1, srv2, ...], ... }
+# and star_nets { (src1, src2, ...): [dst1, dst2, ...], ... }
+def optimize(policy, star_nets):
+	services = {}  # { service: { srcnet: [dstnet1, dstnet2, ...] }, ... }
+	debug("First iteration is completed. %d rules, and %d \"allow all\" rules found" % (len(policy), len(star_nets)))
+	debug(policy, 3)
+
+	star_nets = group_nets(star_nets)
+	star_index = star_trie(star_nets)
+	debug("Allow rules are reduced to %d" % len(star_nets))
+	debug("Second ineration begins")
+
+	# Second iteration
+	# Combine services together and remove overlaps
+	# Iterating over policy.keys(), because some entries will be removed from policy
+	# for pair in policy.keys() - was working fir Python2
+	# For Python3 - explanation  here:
+	# https://stackoverflow.com/questions/11941817/how-to-avoid-runtimeerror-dictionary-changed-size-during-iteration-error
+
+	for pair in list(policy):
+		# If the servie is ip * - delete this line
+		if 'ip' in policy[pair] and '*' in policy[pair]['ip']:
+			debug("Removing *", 4)
+			debug(pair, 4)
+			debug(policy[pair], 4)
+			del policy[pair]
+		# Testing src, dst against star_nets
+		elif are_nets_in(pair[0], pair[1], star_index):
+			debug("Removing networks matching star_nets", 4)
+			debug(pair, 4)
+			debug(policy[pair], 4)
+			del policy[pair]
+		else:
+			for proto in policy[pair]:
+				if len(policy[pair][proto]) > 1:
+					# First combine all TCP/UDP services
+					if ("tcp" in proto or "udp" in proto) and not args.nomerge:
+						policy[pair][proto] = squeeze(policy[pair][proto])
+			tmparr = policy[pair]
+			policy[pair] = []
+			for proto in tmparr:
+				if tmparr[proto]:
+					for port in tmparr[proto]:
+						policy[pair].append(proto + ":" + port)
+				else:
+					policy[pair].append(proto)
+
+	debug("Second iteration is completed. %d rules left" % len(policy))
+	debug(policy, 3)
+
+	# Third iteration is to create a list of networks per allowed service
+	# From policy to services
+	# policy is a dict of (Net, Net): [ port_list]
+	# services is a dict of Service: list(Net)
+	for pair in policy:
+		for srv in policy[pair]:
+			if srv not in services.keys():
+				services[srv] = {}
+			add_net_pair(pair[0], pair[1], services[srv])
+
+	debug("Third iteration is completed. %d services are in the policy" % len(services))
+
+	policy = {}
+	debug(services, 3)
+
+	# Fourth iteration
+	for srv in services:
+		# Grouping SRC and DST networks per service
+		services[srv] = group_nets(services[srv])
+		# Grouping services together, based on the same src-dst pairs
+		# All indexes must be immutable, hence converting to tuples
+		# separately, src (keys) and dst (values) per srv
+		for src in services[srv]:
+			add_srv(srv, (src, tuple(services[srv][src])), policy)
+
+	debug("Fourth iteration is completed. %d rules in the policy, plus %d \"allow all\" rules" % (len(policy), len(star_nets)))
+	debug("Modified services", 3)
+	debug(services, 3)
+	debug("Resulting policy")
+	# print "Finished grouping service nets"
+	debug(policy, 3)
+	return policy, star_nets
+
+
+# The optimized policy as records {"src": [Net, ...], "dst": [Net, ...], "srv": [srv, ...]}
+# The "allow all" rules are the last ones
+def policy_records(policy, star_nets):
+	for nets in policy:
+		yield {'src': nets[0], 'dst': nets[1], 'srv': policy[nets]}
 	for net in star_nets:
-		src = ",".join(map(lambda x: str(x), net))
-		dst = ",".join(map(lambda x: str(x), star_nets[net]))
-		print(src, dst, "*")
+		yield {'src': net, 'dst': star_nets[net], 'srv': ["*"]}
+
+
+# Print the rule as a text line, or as a JSON record with --json
+def print_rule(record):
+	if args.json:
+		print(json.dumps(record, separators=(',', ':')))
+	else:
+		print(",".join(map(lambda x: str(x), record['src'])), ",".join(map(lambda x: str(x), record['dst'])),
+			  ",".join(record['srv']))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('pol', default="-", nargs='?', help="Firewall policy or \"-\" (default) to read from the console")
+# parser.add_argument('--group', help='Group services and networks together', action="store_true")
+parser.add_argument('-v', '--verbose', default=0,
+					help='Verbose mode. Messages are sent to STDERR.\n To increase the level add "v", e.g. -vvv',
+					action='count')
+parser.add_argument('--nomerge', help='Do not merge ports', action="store_true")
+parser.add_argument('--json', help='Print JSON records with integer addresses (accepted by genacl.py)',
+					action="store_true")
+# The defaults, when imported (see aclpipe.py)
+args = parser.parse_args([])
+
+mode = ''  # True if addr srv, False if addr1 addr2 srv
+
+if __name__ == '__main__':
+	args = parser.parse_args()
+	policy = {}
+	star_nets = {}  # { [srcnet1, srcnet2, ...]: [dstnet1, dstnet2, ...], ... }
+
+	f = sys.stdin if "-" == args.pol else open(args.pol, "r")
+	debug("Reading from " + args.pol)
+
+	# First iteration
+	# Create star_nets
+	# Create policy { (src1,dst1): {proto1:[port_list], proto2:[port_list]}, ... }
+	# Fix services, then fix srcnet, and aggregate dstnet
+	for srcnet, dstnet, service in read_policy(f):
+		add_rule(srcnet, dstnet, service, policy, star_nets)
+
+	policy, star_nets = optimize(policy, star_nets)
+	for record in policy_records(policy, star_nets):
+		print_rule(record)
 
-debug("All done. There are %d rules in the policy." % (len(policy) + len(star_nets)))
+	debug("All done. There are %d rules in the policy." % (len(policy) + len(star_nets)))
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+# Regression tests of asaconf.py, run from the repository root:
+# python3 -m unittest discover tests
+
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A range object, nested groups and an ACL with non-contiguous lines
+conf = """\
+hostname fw1
+object network R1
+ range 10.0.0.1 10.0.0.10
+object network H1
+ host 10.5.5.5
+object-group network G1
+ network-object object R1
+ network-object host 10.1.1.1
+object-group network G2
+ network-object 10.2.0.0 255.255.255.0
+ network-object 10.2.1.0 255.255.255.0
+ group-object G1
+object-group service S1 tcp
+ port-object eq www
+ port-object range 1000 2000
+access-list A1 extended permit tcp object-group G2 object H1 object-group S1
+access-list A1 extended permit tcp-udp any host 10.3.3.3 eq 53
+access-list B1 extended deny ip host 10.9.9.9 any
+access-list A1 extended permit icmp any any echo
+access-group A1 in interface outside
+access-group B1 in interface inside
+"""
+
+
+def asaconf(*options, cwd=None):
+	return subprocess.run([sys.executable, os.path.join(root, "asaconf.py"), *options],
+						  capture_output=True, text=True, timeout=60, cwd=cwd)
+
+
+class TempConf(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.conf = os.path.join(self.dir, "fw.conf")
+		with open(self.conf, "w") as f:
+			f.write(conf)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+
+class TestPolicy(TempConf):
+
+	def test_policy(self):
+		# The range is split into networks, G2 networks are aggregated
+		policy = asaconf("--policy", self.conf).stdout.splitlines()
+		self.assertEqual(len(policy), 18)
+		self.assertEqual(policy[:4], [
+			"10.0.0.1 255.255.255.255 10.5.5.5 255.255.255.255 tcp:80",
+			"10.0.0.1 255.255.255.255 10.5.5.5 255.255.255.255 tcp:1000-2000",
+			"10.0.0.2 255.255.255.254 10.5.5.5 255.255.255.255 tcp:80",
+			"10.0.0.2 255.255.255.254 10.5.5.5 255.255.255.255 tcp:1000-2000"])
+		self.assertIn("10.2.0.0 255.255.254.0 10.5.5.5 255.255.255.255 tcp:80", policy)
+		self.assertEqual(policy[-4:], [
+			"0.0.0.0 0.0.0.0 10.3.3.3 255.255.255.255 tcp:53",
+			"0.0.0.0 0.0.0.0 10.3.3.3 255.255.255.255 udp:53",
+			"10.9.9.9 255.255.255.255 0.0.0.0 0.0.0.0 * deny",
+			"0.0.0.0 0.0.0.0 0.0.0.0 0.0.0.0 icmp:8"])
+
+	def test_action(self):
+		self.assertEqual(asaconf("--policy", "--deny", self.conf).stdout, "10.9.9.9 255.255.255.255 0.0.0.0 0.0.0.0 *\n")
+		self.assertEqual(len(asaconf("--policy", "--permit", self.conf).stdout.splitlines()), 17)
+
+	def test_name(self):
+		self.assertEqual(asaconf("--policy", "--name", "B1", self.conf).stdout,
+						 "10.9.9.9 255.255.255.255 0.0.0.0 0.0.0.0 * deny\n")
+
+
+class TestCount(TempConf):
+
+	def test_count(self):
+		# The elements are counted without the aggregation, the rules with the most elements first
+		self.assertEqual(asaconf("--count", self.conf).stdout.splitlines(), [
+			"A1 19 3",
+			"B1 1 1",
+			"Total: 20 4",
+			"",
+			"16 8*1*2 A1 1 access-list A1 extended permit tcp object-group G2 object H1 object-group S1",
+			"2 1*1*2 A1 2 access-list A1 extended permit tcp-udp any host 10.3.3.3 eq 53",
+			"1 1*1*1 B1 1 access-list B1 extended deny ip host 10.9.9.9 any",
+			"1 1*1*1 A1 1 access-list A1 extended permit icmp any any echo"])
+
+	def test_top(self):
+		self.assertEqual(asaconf("--count", "--top", "1", self.conf).stdout.splitlines()[4:], [
+			"16 8*1*2 A1 1 access-list A1 extended permit tcp object-group G2 object H1 object-group S1"])
+
+	def test_noaggr(self):
+		# The count does not depend on the aggregation
+		self.assertEqual(asaconf("--count", "--noaggr", self.conf).stdout, asaconf("--count", self.conf).stdout)
+
+
+class TestPages(TempConf):
+
+	def setUp(self):
+		super().setUp()
+		self.pages = os.path.join(self.dir, "pages")
+
+	def read(self, name):
+		with open(os.path.join(self.pages, name)) as f:
+			return f.read()
+
+	def test_pages(self):
+		self.assertEqual(asaconf("--html", "--pages", self.pages, self.conf).returncode, 0)
+		self.assertEqual(sorted(os.listdir(self.pages)), ["A1.html", "B1.html", "index.html", "objects.html"])
+		# The rules link to the groups, every group used by the rules is written once
+		self.assertIn("<a href=objects.html#G2>G2</a>", self.read("A1.html"))
+		objects = self.read("objects.html")
+		for grp in "G2", "S1":
+			self.assertEqual(objects.count("<h3 id=%s>" % grp), 1)
+		index = self.read("index.html")
+		for acl in "A1", "B1":
+			self.assertIn("<a href=%s.html>%s</a>" % (acl, acl), index)
+
+	def test_not_contiguous(self):
+		# The lines of A1 after B1 are in the same page, nothing after the end of the page
+		asaconf("--html", "--pages", self.pages, self.conf)
+		page = self.read("A1.html")
+		self.assertTrue(page.endswith("</table><br /><br />\n</body></html>\n"))
+		self.assertEqual(page.count("</html>"), 1)
+		self.assertEqual(page.count("<table"), page.count("</table>"))
+		self.assertIn("icmp:echo", page)
+
+	def test_name(self):
+		# Only the page of the ACL, the index does not link to the other ACLs
+		asaconf("--html", "--pages", self.pages, "--name", "B1", self.conf)
+		self.assertEqual(sorted(os.listdir(self.pages)), ["B1.html", "index.html", "objects.html"])
+		self.assertNotIn("A1.html", self.read("index.html"))
+
+	def test_requires_html(self):
+		self.assertNotEqual(asaconf("--acl", "--pages", self.pages, self.conf).returncode, 0)
+
+
+class TestFleet(TempConf):
+
+	def setUp(self):
+		super().setUp()
+		# fwa - plain, fwb - gzipped, fwc - missing
+		os.mkdir(os.path.join(self.dir, "fwa"))
+		shutil.copy(self.conf, os.path.join(self.dir, "fwa", "fwa.conf"))
+		os.mkdir(os.path.join(self.dir, "fwb"))
+		with gzip.open(os.path.join(self.dir, "fwb", "fwb.conf"), "wt") as f:
+			f.write(conf.replace("hostname fw1", "hostname fw2"))
+		with open(os.path.join(self.dir, "asa.list"), "w") as f:
+			f.write("# IP-address fwname\n10.0.0.1 fwa\n10.0.0.2 fwb\n10.0.0.3 fwc\n")
+
+	def test_summary(self):
+		fleet = asaconf("--fleet", "asa.list", "--count", "-j", "2", cwd=self.dir)
+		self.assertEqual(fleet.returncode, 0, fleet.stderr)
+		self.assertEqual(fleet.stdout.splitlines(), [
+			"# firewall hostname ACLs rules elements objects network-groups service-groups protocol-groups",
+			"fwa fw1 2 4 20 2 2 1 0",
+			"fwb fw2 2 4 20 2 2 1 0",
+			"Total: 2 4 8 40 4 4 2 0"])
+		self.assertIn("fwc", fleet.stderr)
+
+	def test_same_as_single(self):
+		# Every firewall gets the same output as converted alone
+		for option, ext in ("--acl", "acl"), ("--count", "count"), ("--policy", "policy"):
+			with self.subTest(option=option):
+				asaconf("--fleet", "asa.list", option, cwd=self.dir)
+				single = asaconf(option, self.conf).stdout
+				for fw in "fwa", "fwb":
+					with open(os.path.join(self.dir, fw, fw + "." + ext)) as f:
+						self.assertEqual(f.read(), single)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+
+# Regression tests of genacl.py, run from the repository root:
+# python3 -m unittest discover tests
+
+import os
+import subprocess
+import sys
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Run the tools one after another, the output of every one is the input of the next
+# Every tool is a list: script name and options
+def pipeline(*tools, data=None):
+	for script, *options in tools:
+		result = subprocess.run([sys.executable, os.path.join(root, script), *options],
+								input=data, capture_output=True, text=True, timeout=60)
+		if result.returncode:
+			raise AssertionError("%s: %s" % (script, result.stderr))
+		data = result.stdout
+	return data
+
+
+class TestJson(unittest.TestCase):
+
+	def test_same_as_text(self):
+		# The JSON records give the same ACLs as the text lines, also for 0.0.0.0/0
+		acl = os.path.join(root, "test.acl")
+		text = pipeline(["ipaclmatch.py", "-p", "--permit", acl], ["optimacl.py"])
+		json = pipeline(["ipaclmatch.py", "-p", "--permit", "--json", acl], ["optimacl.py", "--json"])
+		self.assertIn("0.0.0.0/0", text)
+		for dev in "asa", "fgt", "r77":
+			with self.subTest(dev=dev):
+				expected = pipeline(["genacl.py", "--dev", dev], data=text)
+				self.assertTrue(expected)
+				self.assertEqual(pipeline(["genacl.py", "--dev", dev], data=json), expected)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+
+# Regression tests of ipaclmatch.py, run from the repository root:
+# python3 -m unittest discover tests
+
+import ipaddress
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+testacl = os.path.join(root, "test.acl")
+
+# Every kind of the destination port, line 6 allows any port
+svcacl = """\
+access-list P line 1 extended permit tcp any host 10.1.1.1 eq www (hitcnt=0) 0x1
+access-list P line 2 extended permit tcp any host 10.1.1.2 range 1000 2000 (hitcnt=0) 0x2
+access-list P line 3 extended permit tcp any host 10.1.1.3 gt 1023 (hitcnt=0) 0x3
+access-list P line 4 extended permit tcp any host 10.1.1.4 lt 1024 (hitcnt=0) 0x4
+access-list P line 5 extended permit tcp any host 10.1.1.5 neq www (hitcnt=0) 0x5
+access-list P line 6 extended permit ip any host 10.1.1.6 (hitcnt=0) 0x6
+access-list P line 7 extended permit udp any host 10.1.1.7 eq 80 (hitcnt=0) 0x7
+"""
+
+
+def ipaclmatch(*options, input=None):
+	return subprocess.run([sys.executable, os.path.join(root, "ipaclmatch.py"), *options],
+						  input=input, capture_output=True, text=True, timeout=60)
+
+
+class TempDir(unittest.TestCase):
+	"""
+	Every test gets its own directory for the ACL files
+	"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def write(self, name, text):
+		path = os.path.join(self.dir, name)
+		with open(path, "w") as f:
+			f.write(text)
+		return path
+
+
+class TestJobs(TempDir):
+
+	def test_policy_with_default_both(self):
+		# The pool workers must not check the options completed by the parent again (--both with -p)
+		acls = []
+		for name in "a1.acl", "a2.acl":
+			acls.append(os.path.join(self.dir, name))
+			shutil.copy(testacl, acls[-1])
+		jobs = ipaclmatch("-j", "2", "-p", "--permit", *acls)
+		one = ipaclmatch("-p", "--permit", *acls)
+		self.assertEqual(jobs.returncode, 0, jobs.stderr)
+		self.assertTrue(jobs.stdout)
+		self.assertEqual(jobs.stdout, one.stdout)
+
+
+class TestCount(unittest.TestCase):
+
+	def test_same_as_src_and_dst(self):
+		# One pass with --count gives the amount of the lines of the --src and --dst searches
+		addr = "10.3.0.1,10.228.0.0/16"
+		src = ipaclmatch("-s", "-a", addr, testacl).stdout.splitlines()
+		dst = ipaclmatch("-d", "-a", addr, testacl).stdout.splitlines()
+		self.assertTrue(src and dst)
+		count = ipaclmatch("-c", "-a", addr, testacl)
+		self.assertEqual(count.stdout, "%s %d %d\n" % (testacl, len(src), len(dst)))
+
+
+class TestCache(TempDir):
+
+	def setUp(self):
+		super().setUp()
+		self.acl = os.path.join(self.dir, "t.acl")
+		shutil.copy(testacl, self.acl)
+
+	def test_same_as_without_cache(self):
+		for options in (["-a", "10.0.0.0/8", "-s"], ["-a", "10.3.0.1,10.228.0.0/16"], ["--noany", "-a", "10.3.0.2", "-d"],
+						["--proto", "udp", "--port", "53", "--permit", "-p"], ["-c", "-a", "10.0.0.0/8"]):
+			with self.subTest(options=options):
+				expected = ipaclmatch(*options, self.acl).stdout
+				self.assertTrue(expected)
+				# The first run saves the cache, the second one reads it
+				self.assertEqual(ipaclmatch("--cache", *options, self.acl).stdout, expected)
+				self.assertTrue(os.path.exists(self.acl + ".cache"))
+				self.assertEqual(ipaclmatch("--cache", *options, self.acl).stdout, expected)
+
+	def test_stale(self):
+		# The cache of a changed ACL file is not used
+		ipaclmatch("--cache", "-a", "10.99.1.1", self.acl)
+		with open(self.acl, "a") as f:
+			f.write("access-list Test-ACL line 9 extended permit tcp host 10.99.1.1 any eq 22 (hitcnt=0) 0x9\n")
+		found = ipaclmatch("--cache", "-a", "10.99.1.1", "-s", self.acl)
+		self.assertIn("host 10.99.1.1 any eq 22", found.stdout)
+		self.assertEqual(ipaclmatch("--cache", "-a", "10.99.1.1", "-s", self.acl).stdout, found.stdout)
+
+
+class TestService(TempDir):
+
+	def test_port(self):
+		# lt and gt do not include the port, neq excludes it, ip and lines without ports match any port
+		acl = self.write("p.acl", svcacl)
+		for port, lines in (("80", [1, 4, 6]), ("1500", [2, 3, 5, 6]), ("1023", [2, 4, 5, 6]), ("1024-1100", [2, 3, 5, 6])):
+			with self.subTest(port=port):
+				found = ipaclmatch("--proto", "tcp", "--port", port, acl).stdout.splitlines()
+				self.assertEqual([int(line.split()[3]) for line in found], lines)
+
+	def test_proto(self):
+		acl = self.write("p.acl", svcacl)
+		found = ipaclmatch("--proto", "udp", acl).stdout.splitlines()
+		self.assertEqual([int(line.split()[3]) for line in found], [6, 7])
+
+	def test_port_requires_proto(self):
+		self.assertEqual(ipaclmatch("--port", "80", self.write("p.acl", svcacl)).returncode, 1)
+
+
+class TestFlows(TempDir):
+
+	def test_first_match(self):
+		flows = self.write("flows", "10.228.1.1 10.3.0.2 tcp:123\n1.1.1.1 10.3.10.5 udp:40000\n"
+								   "13.20.1.1 10.7.1.1 icmp:8\n1.1.1.1 10.3.10.5 udp:123\n")
+		found = ipaclmatch("--flows", flows, testacl).stdout.splitlines()
+		self.assertEqual([line.split(None, 4)[3:] for line in found], [
+			[testacl, "access-list Test-ACL line 3 extended permit tcp 10.228.0.0 255.252.0.0 host 10.3.0.2 eq 123"],
+			[testacl, "access-list Test-ACL line 7 extended permit udp any 10.3.10.0 255.255.255.0 gt 30000"],
+			[testacl, "access-list Test-ACL line 7 extended permit icmp any any"],
+			[testacl, "access-list Test-ACL line 8 extended deny ip any any"]])
+
+	def test_files(self):
+		# The same ACL name in different files is a different ACL
+		a1 = self.write("a1.acl", "access-list T line 1 extended permit tcp any host 10.1.1.1 eq 22 (hitcnt=0) 0x1\n")
+		a2 = self.write("a2.acl", "access-list T line 1 extended deny ip any any (hitcnt=0) 0x2\n")
+		flows = self.write("flows", "10.2.2.2 10.1.1.1 tcp:22\n")
+		self.assertEqual(ipaclmatch("--flows", flows, a1, a2).stdout.splitlines(), [
+			"10.2.2.2 10.1.1.1 tcp:22 %s access-list T line 1 extended permit tcp any host 10.1.1.1 eq 22" % a1,
+			"10.2.2.2 10.1.1.1 tcp:22 %s access-list T line 1 extended deny ip any any" % a2])
+
+	def test_source_port(self):
+		acl = self.write("s.acl",
+						 "access-list S line 1 extended permit udp host 10.1.1.1 eq 53 host 10.2.2.2 (hitcnt=0) 0x1\n"
+						 "access-list S line 2 extended deny udp host 10.1.1.1 host 10.2.2.2 (hitcnt=0) 0x2\n")
+		flows = self.write("flows", "10.1.1.1 10.2.2.2 udp:53\n10.1.1.1 10.2.2.2 udp:53 53\n10.1.1.1 10.2.2.2 udp:53 1024\n")
+		found = ipaclmatch("--flows", flows, acl).stdout.splitlines()
+		self.assertEqual(["deny" in line for line in found], [True, False, True])
+
+
+class TestHits(TempDir):
+
+	def test_inactive(self):
+		# The hits of the inactive and time-range inactive lines are counted, (inactive) is not a part of the rule
+		acl = self.write("i.acl",
+						 "access-list I line 1 extended permit tcp any host 10.1.1.1 eq www (hitcnt=5) (inactive) 0x1a2b\n"
+						 "access-list I line 2 extended permit tcp any host 10.1.1.2 eq www time-range TR (hitcnt=7) (inactive) 0x1a2c\n"
+						 "access-list I line 3 extended permit tcp any host 10.1.1.3 eq www (hitcnt=3) 0x1a2d\n")
+		hits = ipaclmatch("--hits", acl)
+		self.assertEqual(hits.stdout.splitlines(), [
+			"7 %s I 2 1 permit tcp any host 10.1.1.2 eq www time-range TR" % acl,
+			"5 %s I 1 1 permit tcp any host 10.1.1.1 eq www" % acl,
+			"3 %s I 3 1 permit tcp any host 10.1.1.3 eq www" % acl])
+
+	def test_elements(self):
+		# The hits of the elements are summed per rule, the parent line is not counted
+		acl = self.write("g.acl",
+						 "access-list G line 1 extended permit tcp object-group A any eq 22 (hitcnt=10) 0xaa\n"
+						 "  access-list G line 1 extended permit tcp host 10.1.1.1 any eq 22 (hitcnt=4) 0xa1\n"
+						 "  access-list G line 1 extended permit tcp host 10.1.1.2 any eq 22 (hitcnt=6) 0xa2\n"
+						 "access-list G line 2 extended permit tcp any any eq 80 (hitcnt=20) 0xbb\n")
+		self.assertEqual(ipaclmatch("--hits", acl).stdout.splitlines(), [
+			"20 %s G 2 1 permit tcp any any eq 80" % acl,
+			"10 %s G 1 2 permit tcp object-group A any eq 22" % acl])
+
+	def test_since(self):
+		# The rules are matched by the hash, also when the line numbers change
+		old = self.write("old.acl",
+						 "access-list G line 1 extended permit tcp any any eq 80 (hitcnt=20) 0xbb\n"
+						 "access-list G line 2 extended permit tcp any any eq 22 (hitcnt=5) 0xcc\n")
+		new = self.write("new.acl",
+						 "access-list G line 1 extended permit tcp any any eq 443 (hitcnt=3) 0xdd\n"
+						 "access-list G line 2 extended permit tcp any any eq 80 (hitcnt=50) 0xbb\n"
+						 "access-list G line 3 extended permit tcp any any eq 22 (hitcnt=6) 0xcc\n")
+		since = ipaclmatch("--hits", "--since", old, new).stdout.splitlines()
+		self.assertEqual([line.split()[0] + " " + " ".join(line.split()[2:5]) for line in since],
+						 ["30 %s G 2" % new, "3 %s G 1" % new, "1 %s G 3" % new])
+
+
+class TestDedup(TempDir):
+
+	def test_source_port(self):
+		# The lines differing only in the source port are not duplicates
+		acl = self.write("d.acl",
+						 "access-list D line 1 extended permit udp host 10.1.1.1 eq 53 host 10.2.2.2 eq 53 (hitcnt=0) 0x1\n"
+						 "access-list D line 1 extended permit udp host 10.1.1.1 eq 123 host 10.2.2.2 eq 53 (hitcnt=0) 0x1\n"
+						 "access-list D line 2 extended permit udp host 10.1.1.1 eq 53 host 10.2.2.2 eq 53 (hitcnt=0) 0x2\n")
+		dedup = ipaclmatch("--dedup", acl)
+		self.assertEqual(len(dedup.stdout.splitlines()), 2, dedup.stdout)
+		self.assertIn("eq 123", dedup.stdout)
+		self.assertIn("1 duplicate lines dropped", dedup.stderr)
+
+	def test_policy(self):
+		# Only the repeated lines are dropped
+		acl = self.write("d.acl", open(testacl).read() * 2)
+		dedup = ipaclmatch("-p", "--permit", "--dedup", acl).stdout.splitlines()
+		once = ipaclmatch("-p", "--permit", testacl).stdout.splitlines()
+		self.assertEqual(sorted(set(dedup)), sorted(set(once)))
+		self.assertEqual(len(dedup), len(set(dedup)))
+
+
+class TestJson(unittest.TestCase):
+
+	def test_same_as_text(self):
+		# Every JSON record is the text line with integer networks
+		text = ipaclmatch("-p", "--permit", testacl).stdout.splitlines()
+		records = [json.loads(line) for line in ipaclmatch("-p", "--permit", "--json", testacl).stdout.splitlines()]
+		self.assertEqual(len(records), len(text))
+		for line, record in zip(text, records):
+			srcip, srcmask, dstip, dstmask, srv = line.split()
+			for (addr, plen), ip, mask in (record['src'][0], srcip, srcmask), (record['dst'][0], dstip, dstmask):
+				net = ipaddress.ip_network(ip + "/" + mask, strict=False)
+				self.assertEqual((ipaddress.ip_address(addr), plen), (net.network_address, net.prefixlen))
+			self.assertEqual(record['srv'], [srv])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+# Regression tests of trafstat.py against trafstat.sh, run from the repository root:
+# python3 -m unittest discover tests
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def asalog(lines, seed=1):
+	"""
+	Cisco ASA log with the permitted, denied, icmp and other messages
+	"""
+	rnd = random.Random(seed)
+	srcs = ['10.2.3.%d' % i for i in range(1, 4)] + ['192.168.1.1']
+	dsts = ['8.8.8.8', '10.1.1.1', '172.16.0.1']
+	log = []
+	for i in range(lines):
+		r = rnd.random()
+		acl = rnd.choice(['inside-in', 'outside-in', 'mgmt'])
+		src, dst = rnd.choice(srcs), rnd.choice(dsts)
+		ts = 'Dec  2 23:05:%02d fw1 %%ASA-4-106100: ' % (i % 60)
+		if r < 0.05:
+			log.append(ts + 'access-list %s permitted icmp inside/%s(8) -> outside/%s(0) hit-cnt 1 first hit [0x1, 0x0]' % (acl, src, dst))
+		elif r < 0.08:
+			log.append(ts + 'Built outbound TCP connection 1 for outside:%s/443 (%s/443) to inside:%s/5555' % (dst, dst, src))
+		elif r < 0.1:
+			log.append(ts + 'access-list %s denied tcp inside/%s(1234) -> outside/%s(80) hit-cnt 1' % (acl, src, dst))
+		else:
+			log.append(ts + 'access-list %s permitted %s inside/%s(%d) -> outside/%s(%d) hit-cnt 1 first hit [0x1, 0x0]' % (
+				acl, rnd.choice(['tcp', 'udp']), src, rnd.randint(1024, 1100), dst, rnd.choice([53, 80, 443, 40000])))
+	return '\n'.join(log) + '\n'
+
+
+def unwrap(script):
+	"""
+	trafstat.sh has some long lines wrapped inside the quotes and before the pipes, join them back
+	"""
+	lines = []
+	for line in script.splitlines():
+		if lines and (lines[-1].count("'") % 2 or line.startswith('|')):
+			lines[-1] += line
+		else:
+			lines.append(line)
+	return '\n'.join(lines) + '\n'
+
+
+def readdir(path):
+	"""
+	File name -> sorted lines, the order of the lines with the same count differs
+	"""
+	out = {}
+	for name in os.listdir(path):
+		with open(os.path.join(path, name)) as f:
+			out[name] = sorted(f.read().splitlines())
+	return out
+
+
+@unittest.skipUnless(shutil.which('bash') and shutil.which('awk'), "bash and awk are required")
+class TestSameAsShell(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.log = os.path.join(self.dir, 'asa.log')
+		with open(self.log, 'w') as f:
+			f.write(asalog(12000))
+		with open(os.path.join(root, 'trafstat.sh')) as f:
+			self.script = os.path.join(self.dir, 'trafstat.sh')
+			with open(self.script, 'w') as out:
+				out.write(unwrap(f.read()))
+		# trafstat.sh writes to the directory named after the current time
+		self.sh = os.path.join(self.dir, 'sh')
+		os.mkdir(self.sh)
+		# "sort +0nr" is the old syntax of "sort -k1nr"
+		subprocess.run(['bash', self.script, self.log], cwd=self.sh, capture_output=True, timeout=120, check=True,
+					   env=dict(os.environ, _POSIX2_VERSION='199209'))
+		self.sh = os.path.join(self.sh, os.listdir(self.sh)[0])
+		self.expected = readdir(self.sh)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def trafstat(self, *options):
+		out = os.path.join(self.dir, 'py')
+		shutil.rmtree(out, ignore_errors=True)
+		subprocess.run([sys.executable, os.path.join(root, 'trafstat.py'), '-d', out, *options, self.log],
+					   capture_output=True, timeout=120, check=True)
+		return readdir(out)
+
+	def test_same(self):
+		self.assertIn('inside-in.10', self.expected)
+		self.assertTrue(self.expected['inside-in.10'])
+		self.assertEqual(self.trafstat(), self.expected)
+
+	def test_jobs(self):
+		# The log of about 1.5 MB is scanned in two chunks
+		self.assertEqual(self.trafstat('-j', '2', '--chunk', '1'), self.expected)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,399 @@
+#!/usr/bin/python3
+
+# Allowed traffic statistics per ACL from the Cisco ASA logs, same files as trafstat.sh
+# Every log line is read and parsed once
+
+import argparse
+import collections
+import hashlib
+import multiprocessing
+import os
+import pickle
+import re
+import sys
+import time
+import pprint
+
+from zfile import compressed, zopen
+
+
+def debug(string, level=1):
+	if args.verbose >= level:
+		pprint.pprint(string, sys.stderr, width=70)
+
+
+# %ASA-6-106100: access-list inside-in permitted tcp inside/10.2.3.12(51234) -> outside/8.8.8.8(53) hit-cnt 1 ...
+# ACL, protocol, source IP, destination IP, destination port (None for the protocols without ports)
+re_log = re.compile(rb'access-list (\S+) permitted (\S+) \S*?/([^(\s]+)(?:\(\d+\))? -> \S*?/([^(\s]+)(?:\((\d+)\))?')
+# Approximate size of a counter in bytes, with --approx
+COUNTER_SIZE = 300
+
+
+class TopCounter:
+	"""
+	Approximate counter of the most frequent keys in bounded memory, with --approx
+	Misra-Gries (Frequent) summary with batched decrements: when there are more than 2 * size keys,
+	the (size + 1)-th largest count is subtracted from all the counts and the keys at zero are dropped.
+	Every count is lower than the real one by at most error (the sum of the subtracted counts),
+	and error <= total / (size + 1), so every key seen more than that is kept
+	"""
+
+	def __init__(self, size):
+		self.size = size
+		self.counts = {}
+		self.total = 0
+		self.error = 0
+
+	def add(self, key):
+		counts = self.counts
+		counts[key] = counts.get(key, 0) + 1
+		self.total += 1
+		if len(counts) > 2 * self.size:
+			self.prune()
+
+	def update(self, other):
+		"""
+		Add the counts of another TopCounter (e.g. from another chunk of the logs)
+		"""
+		counts = self.counts
+		for key, n in other.counts.items():
+			counts[key] = counts.get(key, 0) + n
+		self.total += other.total
+		self.error += other.error
+		if len(counts) > 2 * self.size:
+			self.prune()
+
+	def prune(self):
+		cut = sorted(self.counts.values(), reverse=True)[self.size]
+		self.error += cut
+		self.counts = {key: n - cut for key, n in self.counts.items() if n > cut}
+
+	def items(self):
+		return self.counts.items()
+
+
+def newstat():
+	"""
+	Counters of one ACL: [total connections, Counter of (source, destination, protocol, port)]
+	With --approx: [total connections, TopCounter of the connections, of the sources, of the destinations]
+	"""
+	if args.approx:
+		size = max(1, (args.approx << 20) // (6 * COUNTER_SIZE))
+		return [0, TopCounter(size), TopCounter(size), TopCounter(size)]
+	return [0, collections.Counter()]
+
+
+def scan(lines, stat):
+	"""
+	Count the permitted connections of the log lines
+	stat - {ACL: counters of the ACL (see newstat)}
+	The totals include all protocols, the connections exclude ICMP and the ports above 32767
+	"""
+	search = re_log.search
+	for line in lines:
+		if b'permitted' not in line:
+			continue
+		m = search(line)
+		if not m:
+			continue
+		acl, proto, src, dst, port = m.groups()
+		aclstat = stat.get(acl)
+		if aclstat is None:
+			aclstat = stat[acl] = newstat()
+		aclstat[0] += 1
+		if proto.startswith(b'icmp'):
+			continue
+		if port is not None:
+			port = int(port)
+			if port >= 32768:
+				continue
+		if args.approx:
+			aclstat[1].add((src, dst, proto, port))
+			aclstat[2].add(src)
+			aclstat[3].add(dst)
+		else:
+			aclstat[1][(src, dst, proto, port)] += 1
+
+
+def merge(stat, part):
+	"""
+	Add the counters of part (e.g. from another chunk of the logs) to stat
+	"""
+	for acl, counters in part.items():
+		aclstat = stat.get(acl)
+		if aclstat is None:
+			stat[acl] = counters
+		else:
+			aclstat[0] += counters[0]
+			for counter, other in zip(aclstat[1:], counters[1:]):
+				counter.update(other)
+
+
+def chunks(log, size, start=0, end=None):
+	"""
+	Split the log file from start to end (the end of the file by default) into (log, start, end) chunks
+	of about size bytes. The chunks start at the beginning of a line
+	Compressed files cannot be split, they are one chunk with end None, start is the number
+	of the decompressed bytes to skip
+	"""
+	if compressed(log):
+		return [(log, start, None)]
+	if end is None:
+		end = os.path.getsize(log)
+	if start >= end:
+		return []
+	offsets = [start]
+	with open(log, 'rb') as f:
+		while offsets[-1] + size < end:
+			f.seek(offsets[-1] + size)
+			f.readline()
+			if f.tell() >= end:
+				break
+			offsets.append(f.tell())
+	offsets.append(end)
+	return [(log, start, stop) for start, stop in zip(offsets, offsets[1:])]
+
+
+def chunk_lines(f, size):
+	"""
+	The lines of the next size bytes of f
+	"""
+	for line in f:
+		yield line
+		size -= len(line)
+		if size <= 0:
+			break
+
+
+# Scan one chunk of a log file in a worker process of the --jobs pool
+# Returns the counters of the chunk to be merged by the parent
+def scan_chunk(chunk):
+	log, start, end = chunk
+	stat = {}
+	if end is None:
+		with zopen(log) as f:
+			while start > 0:
+				block = f.read(min(start, 1 << 20))
+				if not block:
+					break
+				start -= len(block)
+			scan(f, stat)
+		return stat
+	with open(log, 'rb') as f:
+		f.seek(start)
+		scan(chunk_lines(f, end - start), stat)
+	return stat
+
+
+def head(log):
+	"""
+	Hash of the first line of the log (decompressed), None if there is no complete line yet
+	"""
+	with zopen(log) as f:
+		line = f.readline(1 << 16)
+	return hashlib.sha1(line).hexdigest() if line.endswith(b'\n') else None
+
+
+def last_newline(log, size):
+	"""
+	Offset after the last complete line in the first size bytes of the log
+	The line being written at the end of the log is left for the next run
+	"""
+	with open(log, 'rb') as f:
+		while size > 0:
+			start = max(0, size - (1 << 16))
+			f.seek(start)
+			i = f.read(size - start).rfind(b'\n')
+			if i >= 0:
+				return start + i + 1
+			size = start
+	return 0
+
+
+def plan(log, files, size):
+	"""
+	The chunks of the log that are not scanned yet, and the new checkpoint of the log, with --state
+	files - the checkpoints of the previous run: {'dev', 'inode', 'head', 'offset'}
+	The log is recognized by the inode and the hash of the first line (head). The same head with
+	another inode is a rotated log: renamed, copied or compressed, it is scanned from the saved offset.
+	The same inode with another head is a new log. offset is None for the compressed logs, they are
+	scanned once
+	"""
+	st = os.stat(log)
+	ckpt = {'dev': st.st_dev, 'inode': st.st_ino, 'head': head(log), 'offset': None}
+	same = [f for f in files if ckpt['head'] is not None and f['head'] == ckpt['head']]
+	# The checkpoint of the same inode goes first
+	same.sort(key=lambda f: (f['dev'], f['inode']) != (ckpt['dev'], ckpt['inode']))
+	start = same[0]['offset'] if same else 0
+	if compressed(log):
+		if same and ((same[0]['dev'], same[0]['inode']) == (ckpt['dev'], ckpt['inode']) or start is None):
+			return [], ckpt
+		return chunks(log, size, start), ckpt
+	ckpt['offset'] = end = last_newline(log, st.st_size)
+	# Truncated, or the head was saved from a compressed log
+	if start is None or start > end:
+		start = 0
+	debug("%s: scanning %d-%d" % (log, start, end))
+	return chunks(log, size, start, end), ckpt
+
+
+def load_state(name):
+	"""
+	The counters and the checkpoints saved by the previous run, with --state
+	"""
+	if not os.path.exists(name):
+		return {}, []
+	with open(name, 'rb') as f:
+		state = pickle.load(f)
+	if state['approx'] != args.approx:
+		print("%s was saved with --approx %s, cannot be continued with --approx %s"
+			  % (name, state['approx'], args.approx), file=sys.stderr)
+		sys.exit(1)
+	return state['stat'], state['files']
+
+
+def update_checkpoints(files, checkpoints):
+	"""
+	The checkpoints of the previous runs updated with the checkpoints of this run, with --state
+	A new checkpoint replaces the old one of the same log (the same head). The checkpoints of the logs
+	not given on this run are kept, so the logs are not scanned again from the beginning later
+	"""
+	heads = {ckpt['head'] for ckpt in checkpoints}
+	return [f for f in files if f['head'] is not None and f['head'] not in heads] + checkpoints
+
+
+def save_state(name, stat, files):
+	tmp = name + ".tmp"
+	with open(tmp, 'wb') as f:
+		pickle.dump({'version': 1, 'approx': args.approx, 'stat': stat, 'files': files}, f,
+					pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp, name)
+
+
+def top(conns, field):
+	"""
+	Connections per source (field 0) or destination (field 1), biggest first
+	"""
+	cnt = collections.Counter()
+	for conn, n in conns.items():
+		cnt[conn[field]] += n
+	return biggest(cnt)
+
+
+def biggest(counter):
+	"""
+	The (key, count) pairs, biggest first; only the --top ones with --approx
+	"""
+	items = sorted(counter.items(), key=lambda x: (-x[1], x[0]))
+	return items[:args.top] if args.approx else items
+
+
+def write_stat(stat, outdir):
+	"""
+	Write acl.stat and per ACL: all connections, the sources (.tops), the destinations (.topd),
+	the connections above the threshold (.THOLD) and above 0.01% of the total (.N)
+	"""
+	print("ACL    Count  0.01%   0.02%   0.1%   0.2%")
+	with open(os.path.join(outdir, 'acl.stat'), 'w') as f:
+		for acl, (total, *counters) in sorted(stat.items(), key=lambda x: -x[1][0]):
+			line = "%s %d %d %d %d %d" % (acl.decode(), total, total // 10000, total // 5000, total // 1000, total // 500)
+			print(line)
+			f.write(line + "\n")
+	if args.approx:
+		# ACL, the maximum errors of the counts of the connections, sources and destinations
+		with open(os.path.join(outdir, 'acl.error'), 'w') as f:
+			for acl, (total, conns, srcs, dsts) in stat.items():
+				f.write("%s %d %d %d\n" % (acl.decode(), conns.error, srcs.error, dsts.error))
+	for acl, (total, conns, *tops) in stat.items():
+		acl = acl.decode()
+		if args.approx:
+			print("%s: the counts of the connections, sources and destinations are up to %d, %d, %d lower"
+				  % (acl, conns.error, tops[0].error, tops[1].error))
+		else:
+			print(acl)
+		name = os.path.join(outdir, acl)
+		pct = total // 10000
+		with open(name, 'w') as f, open(name + '.' + str(args.threshold), 'w') as fthold, \
+				open(name + '.' + str(pct), 'w') as fpct:
+			for (src, dst, proto, port), n in biggest(conns):
+				srv = proto.decode() if port is None else "%s:%d" % (proto.decode(), port)
+				line = "%d %s %s %s\n" % (n, src.decode(), dst.decode(), srv)
+				f.write(line)
+				if n > args.threshold:
+					fthold.write(line)
+				if n > pct:
+					fpct.write(line)
+		for field, ext in (0, '.tops'), (1, '.topd'):
+			with open(name + ext, 'w') as f:
+				for ip, n in biggest(tops[field]) if tops else top(conns, field):
+					f.write("%d  %s\n" % (n, ip.decode()))
+
+
+parser = argparse.ArgumentParser(description='Allowed traffic statistics per ACL from the Cisco ASA logs',
+								 epilog='Example: trafstat.py asa.log asa.log.1 asa.log.2')
+parser.add_argument('log', nargs='+', help='Cisco ASA log files, "-" to read from the console')
+parser.add_argument('-d', '--dir', help="Output directory (default: the current date and time, e.g. 20171202_2305)")
+parser.add_argument('-t', '--threshold', default=10, type=int,
+					help="Save the connections seen more than THRESHOLD times in ACL.THRESHOLD (default 10)")
+parser.add_argument('-j', '--jobs', default=1, type=int,
+					help="Scan the logs in JOBS processes. The files are split into chunks, the result is the same")
+parser.add_argument('--chunk', default=64, type=int, help="With --jobs, the chunk size in MB (default 64)")
+parser.add_argument('--approx', type=int, metavar='MB',
+					help="Count the connections, sources and destinations approximately in about MB megabytes per ACL. "
+						 "Only the --top ones are saved, the maximum errors are saved in acl.error")
+parser.add_argument('--top', default=100, type=int, help="With --approx, the number of the top items to save (default 100)")
+parser.add_argument('--state', metavar='FILE',
+					help="Continue the counting saved in FILE by the previous run: only the lines added to the logs "
+						 "since then are scanned. The counters and the position in every log are saved back to FILE")
+parser.add_argument('-v', '--verbose', default=0, help='Verbose mode. Messages are sent to STDERR', action='count')
+args = parser.parse_args(['-'])
+
+
+# Called once before scanning: by the main program and in every --jobs worker
+def setup(options):
+	global args
+	args = options
+
+
+if __name__ == '__main__':
+	setup(parser.parse_args())
+	for log in args.log:
+		if log != "-" and not os.path.isfile(log):
+			print("No such file " + log, file=sys.stderr)
+			sys.exit(1)
+	if args.jobs > 1 and "-" in args.log:
+		print("--jobs cannot be used to read from the console", file=sys.stderr)
+		sys.exit(1)
+	stat, files = load_state(args.state) if args.state else ({}, [])
+	outdir = args.dir or time.strftime('%Y%m%d_%H%M')
+	os.makedirs(outdir, exist_ok=True)
+	print("Saving in " + outdir)
+	# Without --jobs, every file is one chunk
+	size = args.chunk << 20 if args.jobs > 1 else 1 << 62
+	todo = {}
+	checkpoints = []
+	for log in args.log:
+		if log == "-":
+			continue
+		if args.state:
+			todo[log], ckpt = plan(log, files, size)
+			checkpoints.append(ckpt)
+		else:
+			todo[log] = chunks(log, size)
+	if args.jobs > 1:
+		todo = [chunk for log in args.log for chunk in todo[log]]
+		debug("%d chunks" % len(todo))
+		with multiprocessing.Pool(max(1, min(args.jobs, len(todo))), setup, (args,)) as pool:
+			for part in pool.imap_unordered(scan_chunk, todo):
+				merge(stat, part)
+	else:
+		for log in args.log:
+			debug("Reading from " + log)
+			# Compressed logs are decompressed on the fly
+			if log == "-":
+				scan(zopen(log), stat)
+			for chunk in todo.get(log, ()):
+				merge(stat, scan_chunk(chunk))
+	write_stat(stat, outdir)
+	if args.state:
+		save_state(args.state, stat, update_checkpoints(files, checkpoints))
@@ -0,0 +1,82 @@
+# Reading of the compressed (gzip, bzip2, xz) and plain files, shared by the ACL and log tools
+# Standard library only, so the tools importing it get no extra dependencies
+
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import sys
+import threading
+
+
+# Compressed file formats: magic bytes and the module to decompress
+compressors = ((b'\x1f\x8b', gzip), (b'BZh', bz2), (b'\xfd7zXZ\x00', lzma))
+
+
+class ThreadReader(io.RawIOBase):
+	"""
+	Reads the file object f in a separate thread, so the file is decompressed while the lines are parsed
+	(zlib, bz2 and lzma release the GIL while decompressing)
+	The blocks are passed through a short queue, so the memory use is bounded
+	"""
+
+	def __init__(self, f, blocksize=1 << 20):
+		self.queue = queue.Queue(8)
+		self.block = memoryview(b'')
+		self.eof = False
+		threading.Thread(target=self.fill, args=(f, blocksize), daemon=True).start()
+
+	def fill(self, f, blocksize):
+		try:
+			with f:
+				for block in iter(lambda: f.read(blocksize), b''):
+					self.queue.put(block)
+			self.queue.put(b'')
+		except Exception as e:
+			# Corrupted or truncated file, raised in the reader
+			self.queue.put(e)
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		if not self.block:
+			if self.eof:
+				return 0
+			block = self.queue.get()
+			if isinstance(block, Exception):
+				raise block
+			if not block:
+				self.eof = True
+				return 0
+			self.block = memoryview(block)
+		n = min(len(b), len(self.block))
+		b[:n] = self.block[:n]
+		self.block = self.block[n:]
+		return n
+
+
+# Magic bytes of the first block of f
+def magic(f):
+	return f.peek(6)[:6]
+
+
+# Is the file compressed with gzip, bzip2 or xz?
+def compressed(name):
+	with open(name, "rb") as f:
+		return any(magic(f).startswith(m) for m, module in compressors)
+
+
+# Open the file ("-" for the console) for reading in binary mode
+# gzip, bzip2 and xz files are detected by the magic bytes and decompressed in a separate thread
+def zopen(name):
+	f = sys.stdin.buffer if name == "-" else open(name, "rb")
+	start = magic(f)
+	for m, module in compressors:
+		if start.startswith(m):
+			if name != "-":
+				f.close()
+				f = name
+			return io.BufferedReader(ThreadReader(module.open(f)), 1 << 20)
+	return f